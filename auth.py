@@ -1,6 +1,9 @@
 """
 Authentication module for user login and permissions
 """
+import hmac
+import re
+from functools import lru_cache
 import streamlit as st
 from config import load_credentials, load_user_roles
 
@@ -8,12 +11,21 @@ from config import load_credentials, load_user_roles
 USER_CREDENTIALS = load_credentials()
 USER_ROLES = load_user_roles()
 
+# Username choices for the login form, built once
+USERNAMES = list(USER_CREDENTIALS) or ["No users available"]
+_USERNAME_SET = frozenset(USER_CREDENTIALS)
+
+_PARTNER_RE = re.compile(r'partner', re.IGNORECASE)
+
 def authenticate_user(username, password):
     """Authenticate user credentials"""
-    if username in USER_CREDENTIALS and USER_CREDENTIALS[username] == password:
-        return True
-    return False
+    if username not in _USERNAME_SET:
+        return False
+    # Constant-time compare; encode so non-ASCII passwords are accepted
+    stored = str(USER_CREDENTIALS[username]).encode('utf-8')
+    return hmac.compare_digest(stored, (password or '').encode('utf-8'))
 
+@lru_cache(maxsize=256)
 def get_user_role(username):
     """Get user role (Admin, Partner, or User)"""
     # Check if user has explicit role in USER_ROLES
@@ -22,7 +34,7 @@ def get_user_role(username):
     # Default roles based on username
     if username == 'Admin':
         return 'Admin'
-    elif 'partner' in username.lower():
+    elif _PARTNER_RE.search(username):
         return 'Partner'
     else:
         return 'User'
@@ -42,7 +54,7 @@ def show_login_form():
     with st.form("login_form"):
         col1, col2, col3 = st.columns([1, 2, 1])
         with col2:
-            username = st.selectbox("Select User:", list(USER_CREDENTIALS.keys()) if USER_CREDENTIALS else ["No users available"])
+            username = st.selectbox("Select User:", USERNAMES)
             password = st.text_input("Password:", type="password")
             submitted = st.form_submit_button("Login", use_container_width=True)
             
@@ -2,11 +2,105 @@
 Enhanced Comments system with @mentions functionality
 """
 import streamlit as st
-import uuid
+import streamlit.components.v1 as components
 import re
+import logging
+from collections import defaultdict
 from datetime import datetime
+from functools import lru_cache
+from html import escape
+from string import Template
 from database import save_comment, delete_comment, init_supabase
-from email_handler import send_partner_comment_notification, get_user_email
+from utils import is_privileged
+from email_handler import (send_partner_comment_notification, get_user_email, get_user_emails_bulk,
+                           send_emails_batch, mail_pool)
+
+logger = logging.getLogger(__name__)
+
+# Patterns used on every comment render, compiled once
+_MENTION_RE = re.compile(r'@(\w+)')
+_MENTION_CLEAR_RE = re.compile(r'@\w+\s*')
+_HTML_TAG_RE = re.compile(r'<[^>]+>')
+
+_MENTION_SPAN_FMT = (
+    '<span style="background-color: #e3f2fd; color: #1976d2; padding: 2px 4px; '
+    'border-radius: 3px; font-weight: bold;">@{}</span>'
+)
+
+# Mention email body; only the substituted fields vary per recipient
+_MENTION_EMAIL_TMPL = Template("""
+    <html>
+        <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
+            <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
+                <h2 style="color: #ff6b35;">👋 You were mentioned!</h2>
+                
+                <p>Hi $mentioned_user,</p>
+                
+                <p><strong>$commenter</strong> mentioned you in a comment:</p>
+                
+                <div style="background: #fff3e0; padding: 15px; border-left: 4px solid #ff6b35; margin: 20px 0;">
+                    <p><strong>Problem File:</strong> $file_name</p>
+                    <p><strong>Task/Subtask:</strong> $entity_name</p>
+                    <p><strong>$kind:</strong></p>
+                    <p style="font-style: italic; background: white; padding: 10px; border-radius: 4px;">"$clean_comment"</p>
+                </div>
+                
+                <p>Log in to the Problem File Tracker to view the full conversation and respond.</p>
+                
+                <hr style="border: none; border-top: 1px solid #ddd; margin: 30px 0;">
+                <p style="font-size: 12px; color: #666;">
+                    This is an automated mention notification from Problem File Tracker.
+                </p>
+            </div>
+        </body>
+    </html>
+    """)
+
+# Client-side @mention buttons: append to the next text area on the page without
+# a Streamlit rerun. The native value setter + input event keeps React's state in sync.
+_MENTION_BUTTONS_TMPL = Template("""
+    <div style="display: flex; flex-wrap: wrap; gap: 6px; font-family: sans-serif;">$buttons</div>
+    <script>
+        const parentDoc = window.parent.document;
+        const setValue = Object.getOwnPropertyDescriptor(
+            window.parent.HTMLTextAreaElement.prototype, 'value').set;
+        function targetTextarea() {
+            for (const textarea of parentDoc.querySelectorAll('textarea')) {
+                if (window.frameElement.compareDocumentPosition(textarea) & Node.DOCUMENT_POSITION_FOLLOWING) {
+                    return textarea;
+                }
+            }
+            return null;
+        }
+        document.querySelectorAll('button[data-user]').forEach((button) => {
+            button.addEventListener('click', () => {
+                const textarea = targetTextarea();
+                if (!textarea) return;
+                let text = textarea.value;
+                if (text && !text.endsWith(' ')) text += ' ';
+                setValue.call(textarea, text + '@' + button.dataset.user + ' ');
+                textarea.dispatchEvent(new Event('input', { bubbles: true }));
+                textarea.focus();
+            });
+        });
+    </script>
+""")
+
+_MENTION_BUTTON_STYLE = (
+    'background: white; border: 1px solid rgba(49, 51, 63, 0.2); border-radius: 6px; '
+    'padding: 4px 10px; cursor: pointer;'
+)
+
+@st.cache_resource
+def _debug_mode() -> bool:
+    """Read the debug_mode secret once per process"""
+    return bool(st.secrets.get("debug_mode", False))
+
+def _log_mail_failure(future):
+    """Report notification failures from the worker pool"""
+    error = future.exception()
+    if error:
+        logger.error("[EMAIL_NOTIFY ERROR] Background notification failed: %s", error)
 
 # ============================================================================
 # MENTIONS PROCESSING FUNCTIONS
@@ -20,27 +114,40 @@ def extract_mentions(text: str) -> list:
         list: List of mentioned usernames (without @)
     """
     # Find all @mentions (word characters only, no spaces)
-    mentions = re.findall(r'@(\w+)', text)
-    return list(set(mentions))  # Remove duplicates
+    # Remove duplicates, keeping first-seen order
+    return list(dict.fromkeys(_MENTION_RE.findall(text)))
 
-def get_available_users() -> list:
-    """Get list of users available for mentioning"""
+def get_available_users() -> tuple:
+    """Get users available for mentioning"""
     try:
         # First try to get from session state
-        users = st.session_state.data.get('users', [])
-        if users:
-            print(f"[MENTIONS] Found users in session state: {users}")
-            return users
-        
-        # Fallback: try to get from secrets or hardcoded list
-        fallback_users = ['Admin', 'Partner', 'Haris', 'Stan']
-        print(f"[MENTIONS] Using fallback users: {fallback_users}")
-        return fallback_users
+        return _available_users(tuple(st.session_state.data.get('users', ())))
         
     except Exception as e:
-        print(f"[MENTIONS ERROR] Error getting users: {e}")
+        logger.error("[MENTIONS ERROR] Error getting users: %s", e)
         # Last resort fallback
-        return ['Admin', 'Partner', 'User']
+        return ('Admin', 'Partner', 'User')
+
+@lru_cache(maxsize=8)
+def _available_users(users: tuple) -> tuple:
+    """Resolve the mentionable users once per distinct session user list"""
+    if users:
+        logger.debug("[MENTIONS] Found users in session state: %s", users)
+        return users
+    
+    # Fallback: try to get from secrets or hardcoded list
+    fallback_users = ('Admin', 'Partner', 'Haris', 'Stan')
+    logger.debug("[MENTIONS] Using fallback users: %s", fallback_users)
+    return fallback_users
+
+def get_available_users_lookup() -> dict:
+    """Get a {lowercase name: canonical name} map of mentionable users"""
+    return _users_lookup(get_available_users())
+
+@lru_cache(maxsize=8)
+def _users_lookup(users: tuple) -> dict:
+    """Build the case-insensitive user lookup once per distinct user list"""
+    return {user.lower(): user for user in users}
 
 def validate_mentions(mentions: list) -> list:
     """
@@ -49,17 +156,10 @@ def validate_mentions(mentions: list) -> list:
     Returns:
         list: Valid usernames that exist in the system
     """
-    available_users = get_available_users()
-    valid_mentions = []
-    
-    for mention in mentions:
-        # Case-insensitive search for users
-        for user in available_users:
-            if user.lower() == mention.lower():
-                valid_mentions.append(user)  # Use correct casing
-                break
+    lookup = get_available_users_lookup()
     
-    return valid_mentions
+    # Case-insensitive match, returning the correct casing
+    return [lookup[mention.lower()] for mention in mentions if mention.lower() in lookup]
 
 def format_comment_with_mentions(text: str) -> str:
     """
@@ -68,19 +168,29 @@ def format_comment_with_mentions(text: str) -> str:
     Returns:
         str: HTML formatted text with highlighted mentions
     """
-    available_users = get_available_users()
+    # Comment text is user input rendered as HTML, so escape it first
+    text = escape(text)
+    
+    # Most comments have no mentions; skip the user lookup and regex entirely
+    if '@' not in text:
+        return text
+    
+    lookup = get_available_users_lookup()
+    
+    # Only run the substitution when at least one mention will be highlighted
+    if not any(mention.lower() in lookup for mention in _MENTION_RE.findall(text)):
+        return text
     
     def replace_mention(match):
-        username = match.group(1)
         # Check if this is a valid user (case-insensitive)
-        for user in available_users:
-            if user.lower() == username.lower():
-                return f'<span style="background-color: #e3f2fd; color: #1976d2; padding: 2px 4px; border-radius: 3px; font-weight: bold;">@{user}</span>'
+        user = lookup.get(match.group(1).lower())
+        if user:
+            return _MENTION_SPAN_FMT.format(user)
         # If not a valid user, return as-is
         return match.group(0)
     
     # Replace @mentions with formatted spans
-    formatted_text = re.sub(r'@(\w+)', replace_mention, text)
+    formatted_text = _MENTION_RE.sub(replace_mention, text)
     return formatted_text
 
 def send_mention_notifications(mentions: list, commenter: str, file_name: str, 
@@ -96,160 +206,177 @@ def send_mention_notifications(mentions: list, commenter: str, file_name: str,
         comment_text: The comment text
         is_reply: Whether this is a reply or new comment
     """
-    for mentioned_user in mentions:
-        # Don't notify if user mentions themselves
-        if mentioned_user == commenter:
+    # Don't notify if user mentions themselves; resolve all emails up front
+    recipients = [mentioned_user for mentioned_user in mentions if mentioned_user != commenter]
+    emails = get_user_emails_bulk(recipients)
+    
+    messages = []
+    for mentioned_user in recipients:
+        user_email = emails.get(mentioned_user)
+        if not user_email:
+            logger.debug("[MENTION] No email found for mentioned user: %s", mentioned_user)
             continue
-            
-        try:
-            user_email = get_user_email(mentioned_user)
-            if not user_email:
-                print(f"[MENTION] No email found for mentioned user: {mentioned_user}")
-                continue
-            
-            # Send mention notification
-            send_mention_email_notification(
-                mentioned_user=mentioned_user,
-                commenter=commenter,
-                file_name=file_name,
-                entity_name=entity_name,
-                comment_text=comment_text,
-                is_reply=is_reply
-            )
-            print(f"[MENTION] Sent mention notification to {mentioned_user}")
-            
-        except Exception as e:
-            print(f"[MENTION ERROR] Failed to notify {mentioned_user}: {e}")
-
-def send_mention_email_notification(mentioned_user: str, commenter: str, file_name: str,
-                                  entity_name: str, comment_text: str, is_reply: bool):
-    """Send email notification for @mention"""
-    from email_handler import send_email_async
+        
+        subject, html_content = build_mention_email(
+            mentioned_user=mentioned_user,
+            commenter=commenter,
+            file_name=file_name,
+            entity_name=entity_name,
+            comment_text=comment_text,
+            is_reply=is_reply
+        )
+        messages.append((user_email, subject, html_content))
     
+    if messages:
+        # One background job sends every mention email with a single SendGrid client
+        future = mail_pool().submit(send_emails_batch, messages)
+        future.add_done_callback(_log_mail_failure)
+        logger.debug("[MENTION] Queued %s mention notification(s)", len(messages))
+
+def build_mention_email(mentioned_user: str, commenter: str, file_name: str,
+                        entity_name: str, comment_text: str, is_reply: bool) -> tuple:
+    """Build the (subject, html_content) of an @mention notification"""
     subject = f"You were mentioned in '{file_name}'"
     
     # Create a clean version of the comment for email (remove HTML formatting)
-    clean_comment = re.sub(r'<[^>]+>', '', comment_text)
-    
-    html_content = f"""
-    <html>
-        <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-            <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
-                <h2 style="color: #ff6b35;">👋 You were mentioned!</h2>
-                
-                <p>Hi {mentioned_user},</p>
-                
-                <p><strong>{commenter}</strong> mentioned you in a comment:</p>
-                
-                <div style="background: #fff3e0; padding: 15px; border-left: 4px solid #ff6b35; margin: 20px 0;">
-                    <p><strong>Problem File:</strong> {file_name}</p>
-                    <p><strong>Task/Subtask:</strong> {entity_name}</p>
-                    <p><strong>{'Reply' if is_reply else 'Comment'}:</strong></p>
-                    <p style="font-style: italic; background: white; padding: 10px; border-radius: 4px;">"{clean_comment}"</p>
-                </div>
-                
-                <p>Log in to the Problem File Tracker to view the full conversation and respond.</p>
-                
-                <hr style="border: none; border-top: 1px solid #ddd; margin: 30px 0;">
-                <p style="font-size: 12px; color: #666;">
-                    This is an automated mention notification from Problem File Tracker.
-                </p>
-            </div>
-        </body>
-    </html>
-    """
+    clean_comment = comment_text if '<' not in comment_text else _HTML_TAG_RE.sub('', comment_text)
+    
+    html_content = _MENTION_EMAIL_TMPL.substitute(
+        mentioned_user=escape(mentioned_user),
+        commenter=escape(commenter),
+        file_name=escape(file_name),
+        entity_name=escape(entity_name),
+        kind='Reply' if is_reply else 'Comment',
+        clean_comment=escape(clean_comment)
+    )
     
-    send_email_async(mentioned_user + "@example.com", subject, html_content)
+    return subject, html_content
 
 # ============================================================================
 # DATABASE HELPER FUNCTIONS
 # ============================================================================
 
+@lru_cache(maxsize=1)
 def get_supabase_client():
-    """Get Supabase client"""
-    from database import init_supabase
+    """Get the shared Supabase client, bound once per process"""
     return init_supabase()
 
 def get_file_owner_from_entity(entity_type: str, entity_id: str):
     """Get file owner and name by looking up through database relationships"""
     try:
-        supabase = get_supabase_client()
-        
-        if entity_type == 'task':
-            response = supabase.table('tasks').select(
-                'problem_files(owner, problem_name)'
-            ).eq('id', entity_id).execute()
-            
-            if response.data and len(response.data) > 0:
-                problem_file = response.data[0].get('problem_files')
-                if problem_file:
-                    return problem_file['owner'], problem_file['problem_name']
-        
-        elif entity_type == 'subtask':
-            response = supabase.table('subtasks').select(
-                'tasks(problem_files(owner, problem_name))'
-            ).eq('id', entity_id).execute()
-            
-            if response.data and len(response.data) > 0:
-                task = response.data[0].get('tasks')
-                if task:
-                    problem_file = task.get('problem_files')
-                    if problem_file:
-                        return problem_file['owner'], problem_file['problem_name']
-        
-        print(f"[DB] Could not find file owner for {entity_type} {entity_id}")
-        return None, None
-        
+        return _owner_for(entity_type, entity_id)
     except Exception as e:
-        print(f"[DB ERROR] Error getting file owner: {e}")
+        logger.error("[DB ERROR] Error getting file owner: %s", e)
         return None, None
 
+def invalidate_file_owner():
+    """Drop cached file owner lookups after a file is renamed or reassigned"""
+    _owner_for.clear()
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _owner_for(entity_type: str, entity_id: str):
+    """Cached single-entity owner lookup (one nested select per entity); errors propagate so they are never cached"""
+    supabase = get_supabase_client()
+    
+    if entity_type == 'task':
+        response = supabase.table('tasks').select(
+            'problem_files(owner, problem_name)'
+        ).eq('id', entity_id).execute()
+        
+        if response.data and len(response.data) > 0:
+            problem_file = response.data[0].get('problem_files')
+            if problem_file:
+                return problem_file['owner'], problem_file['problem_name']
+    
+    elif entity_type == 'subtask':
+        response = supabase.table('subtasks').select(
+            'tasks(problem_files(owner, problem_name))'
+        ).eq('id', entity_id).execute()
+        
+        if response.data and len(response.data) > 0:
+            task = response.data[0].get('tasks')
+            if task:
+                problem_file = task.get('problem_files')
+                if problem_file:
+                    return problem_file['owner'], problem_file['problem_name']
+    
+    logger.debug("[DB] Could not find file owner for %s %s", entity_type, entity_id)
+    return None, None
+
 def get_entity_comments_from_db(entity_type: str, entity_id: str):
-    """Get all comments for a specific entity from database"""
+    """
+    Get all comments for a specific entity from database, newest first
+    
+    Ordering is done server-side; callers rely on it and do not re-sort.
+    Expects the (entity_type, entity_id, created_at) index from
+    migrations/001_comments_indexes.sql so rows come back index-ordered.
+    
+    Returns:
+        list: comment rows ordered by created_at descending
+    """
     try:
-        supabase = get_supabase_client()
-        
-        response = supabase.table('comments').select('*').eq(
-            'entity_type', entity_type
-        ).eq('entity_id', entity_id).order('created_at', desc=False).execute()
-        
-        entity_comments = {}
-        if response.data:
-            for comment in response.data:
-                entity_comments[comment['id']] = comment
-                
-        print(f"[DB] Found {len(entity_comments)} comments for {entity_type} {entity_id}")
-        return entity_comments
-        
+        return _entity_comments_for(entity_type, entity_id)
     except Exception as e:
-        print(f"[DB ERROR] Error getting comments: {e}")
-        return {}
+        logger.error("[DB ERROR] Error getting comments: %s", e)
+        return []
+
+@st.cache_data(ttl=60)
+def _entity_comments_for(entity_type: str, entity_id: str):
+    """Cached comment fetch for one entity; errors propagate so they are never cached"""
+    supabase = get_supabase_client()
+    
+    response = supabase.table('comments').select(
+        'id, user_name, text, created_at, parent_id, user_role'
+    ).eq(
+        'entity_type', entity_type
+    ).eq('entity_id', entity_id).order('created_at', desc=True).execute()
+    
+    entity_comments = response.data or []
+    for comment in entity_comments:
+        # Parse once here so display gets datetimes directly
+        created_at = comment.get('created_at')
+        if isinstance(created_at, str):
+            comment['created_at'] = _parse_timestamp_str(created_at)
+            
+    logger.debug("[DB] Found %s comments for %s %s", len(entity_comments), entity_type, entity_id)
+    return entity_comments
 
 # ============================================================================
 # MAIN COMMENTS SECTION
 # ============================================================================
 
-def show_comments_section(entity_type: str, entity_id: str, entity_name: str):
+def show_comments_section(entity_type: str, entity_id: str, entity_name: str,
+                          file_owner: str = None, file_name: str = None):
     """Display comments section with @mentions support"""
     st.markdown(f"### 💬 Comments for {entity_name}")
-    
-    # Get file owner and name from database
-    file_owner, file_name = get_file_owner_from_entity(entity_type, entity_id)
+
+    # Get file owner and name from database unless the caller already resolved them
+    if not file_owner:
+        file_owner, file_name = get_file_owner_from_entity(entity_type, entity_id)
     
     if not file_owner:
         st.error("❌ Could not determine file owner for notifications")
         return
     
-    # Debug panel for troubleshooting
-    if st.secrets.get("debug_mode", False):
-        show_debug_panel(entity_type, entity_id, file_owner, file_name, entity_name)
+    # Check email notification conditions (resolves the owner's email once)
+    can_notify, owner_email = check_notification_conditions(file_owner)
     
-    # Check email notification conditions
-    can_notify = check_notification_conditions(file_owner)
+    # Debug panel for troubleshooting
+    if _debug_mode():
+        show_debug_panel(entity_type, entity_id, file_owner, file_name, entity_name, owner_email)
     
     # Get existing comments from database
     entity_comments = get_entity_comments_from_db(entity_type, entity_id)
     
+    # Per-render user context, computed once and passed down to every form
+    current_user = st.session_state.current_user
+    other_users = tuple(user for user in get_available_users() if user != current_user)
+    # One flag lookup per comment shown, not a scan of every session_state key
+    open_replies = {
+        comment['id'] for comment in entity_comments
+        if st.session_state.get(f"replying_to_{comment['id']}")
+    }
+    
     # Show comment form with mentions support
     show_comment_form_with_mentions(
         entity_type=entity_type,
@@ -257,7 +384,9 @@ def show_comments_section(entity_type: str, entity_id: str, entity_name: str):
         entity_name=entity_name,
         file_owner=file_owner,
         file_name=file_name,
-        can_notify=can_notify
+        can_notify=can_notify,
+        owner_email=owner_email,
+        other_users=other_users
     )
     
     # Display existing comments
@@ -270,7 +399,9 @@ def show_comments_section(entity_type: str, entity_id: str, entity_name: str):
             entity_id=entity_id,
             file_owner=file_owner,
             file_name=file_name,
-            entity_name=entity_name
+            entity_name=entity_name,
+            other_users=other_users,
+            open_replies=open_replies
         )
     else:
         st.info("💭 No comments yet. Be the first to comment!")
@@ -280,13 +411,13 @@ def show_comments_section(entity_type: str, entity_id: str, entity_name: str):
 # ============================================================================
 
 def show_comment_form_with_mentions(entity_type: str, entity_id: str, entity_name: str,
-                                   file_owner: str, file_name: str, can_notify: bool):
+                                   file_owner: str, file_name: str, can_notify: bool,
+                                   owner_email: str = None, other_users: tuple = None):
     """Display comment form with @mentions support and user selection"""
     
     with st.expander("➕ Add New Comment", expanded=False):
         # Show notification status
         if can_notify:
-            owner_email = get_user_email(file_owner)
             st.success(f"📧 Your comment will notify **{file_owner}** at {owner_email}")
         elif file_owner and file_owner != st.session_state.current_user:
             st.warning(f"⚠️ {file_owner} has no email configured - no notification will be sent")
@@ -299,39 +430,31 @@ def show_comment_form_with_mentions(entity_type: str, entity_id: str, entity_nam
             st.session_state[comment_key] = ""
         
         # Mention selector section
-        available_users = get_available_users()
-        other_users = [user for user in available_users if user != st.session_state.current_user]
+        current_user = st.session_state.current_user
+        if other_users is None:
+            other_users = tuple(user for user in get_available_users() if user != current_user)
         
-        print(f"[DEBUG] Available users: {available_users}")
-        print(f"[DEBUG] Current user: {st.session_state.current_user}")
-        print(f"[DEBUG] Other users: {other_users}")
+        logger.debug("[DEBUG] Current user: %s, other users: %s", current_user, other_users)
         
         if other_users:
             st.markdown("**👥 Mention Someone:**")
-            mention_cols = st.columns(len(other_users) + 1)
+            mention_col, clear_col = st.columns([5, 1])
             
-            for i, user in enumerate(other_users):
-                with mention_cols[i]:
-                    if st.button(f"@{user}", key=f"mention_btn_{user}_{entity_type}_{entity_id}", 
-                                help=f"Add @{user} to your comment"):
-                        # Add mention to comment text
-                        current_text = st.session_state[comment_key]
-                        if current_text and not current_text.endswith(' '):
-                            current_text += " "
-                        st.session_state[comment_key] = current_text + f"@{user} "
-                        st.rerun()
+            # Mention buttons edit the text area in the browser, no rerun needed
+            with mention_col:
+                render_mention_buttons(other_users)
             
             # Clear mentions button
-            with mention_cols[-1]:
+            with clear_col:
                 if st.button("🗑️ Clear", key=f"clear_mentions_{entity_type}_{entity_id}",
                            help="Clear all mentions from comment"):
                     # Remove all @mentions from the text
                     current_text = st.session_state[comment_key]
-                    cleaned_text = re.sub(r'@\w+\s*', '', current_text).strip()
+                    cleaned_text = _MENTION_CLEAR_RE.sub('', current_text).strip()
                     st.session_state[comment_key] = cleaned_text
                     st.rerun()
         else:
-            st.info(f"Debug: No other users found. Available: {available_users}, Current: {st.session_state.current_user}")
+            st.info(f"Debug: No other users found. Available: {get_available_users()}, Current: {current_user}")
         
         # Comment form)
         
@@ -355,7 +478,8 @@ def show_comment_form_with_mentions(entity_type: str, entity_id: str, entity_nam
                 mentions = extract_mentions(comment_text)
                 if mentions:
                     valid_mentions = validate_mentions(mentions)
-                    invalid_mentions = [m for m in mentions if m not in [v.lower() for v in valid_mentions]]
+                    lookup = get_available_users_lookup()
+                    invalid_mentions = [m for m in mentions if m.lower() not in lookup]
                     
                     col1, col2 = st.columns(2)
                     with col1:
@@ -381,29 +505,39 @@ def show_comment_form_with_mentions(entity_type: str, entity_id: str, entity_nam
                         file_name=file_name,
                         can_notify=can_notify,
                         is_reply=False,
-                        parent_id=None
+                        parent_id=None,
+                        owner_email=owner_email
                     )
                 else:
                     st.error("⚠️ Please enter a comment before posting.")
 
+def render_mention_buttons(users) -> None:
+    """Render @mention buttons that append to the following text area client-side"""
+    buttons = ''.join(
+        f'<button type="button" data-user="{escape(user)}" style="{_MENTION_BUTTON_STYLE}" '
+        f'title="Add @{escape(user)}">@{escape(user)}</button>'
+        for user in users
+    )
+    components.html(_MENTION_BUTTONS_TMPL.substitute(buttons=buttons), height=45)
+
 def handle_comment_submission_with_mentions(comment_text: str, entity_type: str, entity_id: str,
                                            entity_name: str, file_owner: str, file_name: str,
-                                           can_notify: bool, is_reply: bool, parent_id: str = None):
+                                           can_notify: bool, is_reply: bool, parent_id: str = None,
+                                           owner_email: str = None):
     """Handle comment submission with @mentions processing"""
     
-    print(f"[COMMENT_SUBMIT] Handling comment submission with mentions")
-    print(f"[COMMENT_SUBMIT] Entity: {entity_type}/{entity_id}")
-    print(f"[COMMENT_SUBMIT] File Owner: {file_owner}")
+    logger.debug("[COMMENT_SUBMIT] Handling comment submission with mentions")
+    logger.debug("[COMMENT_SUBMIT] Entity: %s/%s", entity_type, entity_id)
+    logger.debug("[COMMENT_SUBMIT] File Owner: %s", file_owner)
     
     # Extract and validate mentions
     mentions = extract_mentions(comment_text)
     valid_mentions = validate_mentions(mentions)
     
-    print(f"[MENTIONS] Found mentions: {mentions}")
-    print(f"[MENTIONS] Valid mentions: {valid_mentions}")
+    logger.debug("[MENTIONS] Found mentions: %s", mentions)
+    logger.debug("[MENTIONS] Valid mentions: %s", valid_mentions)
     
     # Create comment data
-    comment_id = str(uuid.uuid4())
     comment_data = {
         'entity_type': entity_type,
         'entity_id': entity_id,
@@ -415,26 +549,30 @@ def handle_comment_submission_with_mentions(comment_text: str, entity_type: str,
     }
     
     # Save comment to database
-    if save_comment(comment_id, comment_data):
-        print(f"[COMMENT_SUBMIT] Comment saved successfully: {comment_id}")
+    # The database generates the comment id
+    comment_id = save_comment(None, comment_data)
+    if comment_id:
+        logger.debug("[COMMENT_SUBMIT] Comment saved successfully: %s", comment_id)
+        _entity_comments_for.clear()
         
         # Send file owner notification (existing logic)
         owner_email_sent = False
         if can_notify and file_owner and file_name:
-            print(f"[COMMENT_SUBMIT] Attempting to send file owner notification")
+            logger.debug("[COMMENT_SUBMIT] Attempting to send file owner notification")
             owner_email_sent = send_email_notification(
                 file_owner=file_owner,
                 commenter=st.session_state.current_user,
                 file_name=file_name,
                 entity_name=entity_name,
                 comment_text=comment_text,
-                is_reply=is_reply
+                is_reply=is_reply,
+                owner_email=owner_email
             )
         
         # Send mention notifications (new logic)
         mention_count = 0
         if valid_mentions:
-            print(f"[MENTIONS] Sending notifications to {len(valid_mentions)} mentioned users")
+            logger.debug("[MENTIONS] Sending notifications to %s mentioned users", len(valid_mentions))
             send_mention_notifications(
                 mentions=valid_mentions,
                 commenter=st.session_state.current_user,
@@ -466,57 +604,67 @@ def handle_comment_submission_with_mentions(comment_text: str, entity_type: str,
         st.rerun()
     else:
         st.error("❌ Failed to save comment. Please try again.")
-        print(f"[COMMENT_SUBMIT] Failed to save comment")
+        logger.warning("[COMMENT_SUBMIT] Failed to save comment")
 
 # ============================================================================
 # HELPER FUNCTIONS (EXISTING)
 # ============================================================================
 
-def check_notification_conditions(file_owner: str) -> bool:
-    """Check if email notifications should be sent"""
+def check_notification_conditions(file_owner: str) -> tuple:
+    """
+    Check if email notifications should be sent
+    
+    Returns:
+        tuple: (can_notify, owner_email); the email is only looked up for other users' files
+    """
     if not file_owner:
-        print(f"[NOTIFICATION] No file owner provided")
-        return False
+        logger.debug("[NOTIFICATION] No file owner provided")
+        return False, None
     
-    is_other_file = file_owner != st.session_state.current_user
-    if not is_other_file:
-        print(f"[NOTIFICATION] User commenting on own file, no notification needed")
-        return False
+    if file_owner == st.session_state.current_user:
+        logger.debug("[NOTIFICATION] User commenting on own file, no notification needed")
+        return False, None
     
     owner_email = get_user_email(file_owner)
     has_email = owner_email is not None
     
-    print(f"[NOTIFICATION] Owner: {file_owner}, Email: {owner_email}, Can notify: {is_other_file and has_email}")
-    return is_other_file and has_email
+    logger.debug("[NOTIFICATION] Owner: %s, Email: %s, Can notify: %s", file_owner, owner_email, has_email)
+    return has_email, owner_email
 
 def send_email_notification(file_owner: str, commenter: str, file_name: str,
-                           entity_name: str, comment_text: str, is_reply: bool) -> bool:
+                           entity_name: str, comment_text: str, is_reply: bool,
+                           owner_email: str = None) -> bool:
     """Send email notification for comment"""
     try:
-        print(f"[EMAIL_NOTIFY] Preparing notification for {file_owner}")
+        logger.debug("[EMAIL_NOTIFY] Preparing notification for %s", file_owner)
         
-        owner_email = get_user_email(file_owner)
+        if owner_email is None:
+            owner_email = get_user_email(file_owner)
         if not owner_email:
-            print(f"[EMAIL_NOTIFY] No email found for {file_owner}")
+            logger.debug("[EMAIL_NOTIFY] No email found for %s", file_owner)
             return False
         
-        print(f"[EMAIL_NOTIFY] Found email for {file_owner}: {owner_email}")
+        logger.debug("[EMAIL_NOTIFY] Found email for %s: %s", file_owner, owner_email)
         
         task_name = f"Reply in {entity_name}" if is_reply else entity_name
         
-        send_partner_comment_notification(
+        # Queue the notification so the user doesn't wait on email delivery
+        future = mail_pool().submit(
+            send_partner_comment_notification,
             file_owner=file_owner,
             partner_name=commenter,
             file_name=file_name,
             task_name=task_name,
-            comment_text=comment_text
+            comment_text=comment_text,
+            owner_email=owner_email
         )
+        future.add_done_callback(_log_mail_failure)
         
-        print(f"[EMAIL_NOTIFY] Email notification sent successfully")
+        logger.debug("[EMAIL_NOTIFY] Email notification queued")
         return True
         
     except Exception as e:
-        print(f"[EMAIL_NOTIFY ERROR] {str(e)}")
+        logger.error("[EMAIL_NOTIFY ERROR] %s", e)
         st.error(f"Email error: {str(e)}")
         return False
 
@@ -524,100 +672,103 @@ def send_email_notification(file_owner: str, commenter: str, file_name: str,
 # ENHANCED COMMENT DISPLAY WITH MENTIONS
 # ============================================================================
 
-def display_comments_list(entity_comments: dict, entity_type: str, entity_id: str,
-                         file_owner: str, file_name: str, entity_name: str):
+def display_comments_list(entity_comments: list, entity_type: str, entity_id: str,
+                         file_owner: str, file_name: str, entity_name: str,
+                         other_users: tuple = (), open_replies: set = None):
     """Display list of comments with @mentions highlighting"""
     
-    root_comments = {
-        cid: comment for cid, comment in entity_comments.items()
-        if not comment.get('parent_id')
-    }
+    # One pass splits roots from replies; roots are newest first
+    root_comments, replies_index = group_comments(entity_comments)
     
-    sorted_comments = sorted(
-        root_comments.items(),
-        key=lambda x: parse_timestamp(x[1].get('created_at')),
-        reverse=True
-    )
+    if open_replies is None:
+        open_replies = set()
     
-    for comment_id, comment in sorted_comments:
+    for comment_id, comment in root_comments:
         display_comment_with_replies(
             comment_id=comment_id,
             comment=comment,
-            all_comments=entity_comments,
+            replies_index=replies_index,
             entity_type=entity_type,
             entity_id=entity_id,
             file_owner=file_owner,
             file_name=file_name,
             entity_name=entity_name,
-            depth=0
+            depth=0,
+            other_users=other_users,
+            open_replies=open_replies
         )
 
-def display_comment_with_replies(comment_id: str, comment: dict, all_comments: dict,
+def build_comment_html(comment: dict, depth: int) -> str:
+    """Compose the read-only part of a comment (badge, author, time, text) as one HTML block"""
+    role_badge = get_role_badge(comment.get('user_role', 'User'))
+    user_name = escape(comment.get('user_name') or comment.get('user', 'Unknown'))
+    timestamp = format_timestamp(comment.get('created_at'))
+    formatted_text = format_comment_with_mentions(comment['text']).replace('\n', '<br>')
+    
+    return (
+        f'<div style="margin-left: {depth * 24}px; border: 1px solid rgba(49, 51, 63, 0.2); '
+        f'border-radius: 8px; padding: 8px 12px; margin-bottom: 4px;">'
+        f'<div>{role_badge} <strong>{user_name}</strong> · {timestamp}</div>'
+        f'<div>{formatted_text}</div>'
+        f'</div>'
+    )
+
+def display_comment_with_replies(comment_id: str, comment: dict, replies_index: dict,
                                 entity_type: str, entity_id: str, file_owner: str,
-                                file_name: str, entity_name: str, depth: int):
+                                file_name: str, entity_name: str, depth: int,
+                                other_users: tuple = (), open_replies: set = None):
     """Display a single comment with @mentions highlighting and its replies"""
+    if open_replies is None:
+        open_replies = set()
     
-    if depth > 0:
-        cols = st.columns([depth * 0.05, 1])
-        container = cols[1]
-    else:
-        container = st.container()
+    # Non-interactive content goes out as a single markdown element
+    st.markdown(build_comment_html(comment, depth), unsafe_allow_html=True)
     
-    with container:
-        with st.container(border=True):
-            col1, col2, col3 = st.columns([0.1, 5, 0.5])
-            
-            with col1:
-                role_badge = get_role_badge(comment.get('user_role', 'User'))
-                st.write(role_badge)
-            
-            with col2:
-                user_name = comment.get('user_name') or comment.get('user', 'Unknown')
-                timestamp = format_timestamp(comment.get('created_at'))
-                st.markdown(f"**{user_name}** · {timestamp}")
-                
-                # Display comment with @mentions highlighted
-                comment_text = comment['text']
-                formatted_text = format_comment_with_mentions(comment_text)
-                st.markdown(formatted_text, unsafe_allow_html=True)
-                
-                if st.button("↩️ Reply", key=f"reply_{comment_id}", use_container_width=False):
-                    st.session_state[f"replying_to_{comment_id}"] = True
-            
-            with col3:
-                if can_delete_comment(comment):
-                    if st.button("🗑️", key=f"delete_{comment_id}", help="Delete comment"):
-                        delete_comment_handler(comment_id)
-            
-            if st.session_state.get(f"replying_to_{comment_id}", False):
-                show_reply_form_with_mentions(
-                    parent_id=comment_id,
-                    entity_type=entity_type,
-                    entity_id=entity_id,
-                    entity_name=entity_name,
-                    file_owner=file_owner,
-                    file_name=file_name
-                )
-        
-        replies = get_replies(comment_id, all_comments)
-        for reply_id, reply in replies:
-            display_comment_with_replies(
-                comment_id=reply_id,
-                comment=reply,
-                all_comments=all_comments,
-                entity_type=entity_type,
-                entity_id=entity_id,
-                file_owner=file_owner,
-                file_name=file_name,
-                entity_name=entity_name,
-                depth=depth + 1
-            )
+    # Reply/Delete are the only real widgets, laid out in one strip
+    _, reply_col, delete_col, _ = st.columns([depth * 0.3 + 0.01, 1, 0.5, 6])
+    
+    with reply_col:
+        if st.button("↩️ Reply", key=f"reply_{comment_id}", use_container_width=False):
+            st.session_state[f"replying_to_{comment_id}"] = True
+            open_replies.add(comment_id)
+    
+    with delete_col:
+        if can_delete_comment(comment):
+            if st.button("🗑️", key=f"delete_{comment_id}", help="Delete comment"):
+                delete_comment_handler(comment_id)
+    
+    if comment_id in open_replies:
+        show_reply_form_with_mentions(
+            parent_id=comment_id,
+            entity_type=entity_type,
+            entity_id=entity_id,
+            entity_name=entity_name,
+            file_owner=file_owner,
+            file_name=file_name,
+            other_users=other_users
+        )
+    
+    for reply_id, reply in replies_index.get(comment_id, ()):
+        display_comment_with_replies(
+            comment_id=reply_id,
+            comment=reply,
+            replies_index=replies_index,
+            entity_type=entity_type,
+            entity_id=entity_id,
+            file_owner=file_owner,
+            file_name=file_name,
+            entity_name=entity_name,
+            depth=depth + 1,
+            other_users=other_users,
+            open_replies=open_replies
+        )
 
 def show_reply_form_with_mentions(parent_id: str, entity_type: str, entity_id: str,
-                                 entity_name: str, file_owner: str, file_name: str):
+                                 entity_name: str, file_owner: str, file_name: str,
+                                 other_users: tuple = ()):
     """Show reply form with @mentions support and user selection"""
     
-    can_notify = check_notification_conditions(file_owner)
+    can_notify, owner_email = check_notification_conditions(file_owner)
     
     # Initialize reply text in session state if not exists
     reply_key = f"reply_draft_{parent_id}"
@@ -629,23 +780,9 @@ def show_reply_form_with_mentions(parent_id: str, entity_type: str, entity_id: s
             st.info(f"📧 Your reply will notify {file_owner}")
         
         # Mention selector for replies
-        available_users = get_available_users()
-        other_users = [user for user in available_users if user != st.session_state.current_user]
-        
         if other_users:
             st.markdown("**👥 Mention in Reply:**")
-            mention_cols = st.columns(min(len(other_users), 4))  # Limit to 4 columns for space
-            
-            for i, user in enumerate(other_users[:4]):  # Show max 4 users
-                with mention_cols[i]:
-                    if st.button(f"@{user}", key=f"reply_mention_{user}_{parent_id}", 
-                                help=f"Add @{user} to your reply"):
-                        # Add mention to reply text
-                        current_text = st.session_state[reply_key]
-                        if current_text and not current_text.endswith(' '):
-                            current_text += " "
-                        st.session_state[reply_key] = current_text + f"@{user} "
-                        st.rerun()
+            render_mention_buttons(other_users)
         
         reply_text = st.text_area(
             "Write your reply:", 
@@ -684,7 +821,8 @@ def show_reply_form_with_mentions(parent_id: str, entity_type: str, entity_id: s
                         file_name=file_name,
                         can_notify=can_notify,
                         is_reply=True,
-                        parent_id=parent_id
+                        parent_id=parent_id,
+                        owner_email=owner_email
                     )
                 else:
                     st.error("Please enter a reply.")
@@ -709,37 +847,29 @@ def get_role_badge(role: str) -> str:
     }
     return badges.get(role, '👤')
 
-def parse_timestamp(timestamp):
-    """Parse timestamp for sorting"""
-    if not timestamp:
-        return datetime.min
-    
-    if isinstance(timestamp, str):
+@lru_cache(maxsize=4096)
+def _parse_timestamp_str(timestamp: str):
+    """Parse an ISO timestamp string once; repeated strings hit the cache"""
+    # Python 3.11+ accepts a trailing 'Z' directly, so try without copying first
+    try:
+        return datetime.fromisoformat(timestamp)
+    except ValueError:
         try:
             return datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-        except:
-            try:
-                return datetime.fromisoformat(timestamp)
-            except:
-                return datetime.min
-    
-    if isinstance(timestamp, datetime):
-        return timestamp
-    
-    return datetime.min
+        except ValueError:
+            return datetime.min
 
+@lru_cache(maxsize=4096)
 def format_timestamp(timestamp) -> str:
-    """Format timestamp for display"""
+    """Format timestamp for display; strings and datetimes are hashable, so results are cached"""
     if not timestamp:
         return "Unknown time"
     
     if isinstance(timestamp, str):
-        try:
-            timestamp = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-        except:
-            return "Unknown time"
+        timestamp = _parse_timestamp_str(timestamp)
     
-    if isinstance(timestamp, datetime):
+    # datetime.min marks a timestamp that failed to parse
+    if isinstance(timestamp, datetime) and timestamp is not datetime.min:
         return timestamp.strftime('%Y-%m-%d %H:%M')
     
     return "Unknown time"
@@ -749,34 +879,51 @@ def can_delete_comment(comment: dict) -> bool:
     user_name = comment.get('user_name') or comment.get('user', '')
     return (
         user_name == st.session_state.current_user or
-        st.session_state.user_role in ['Admin', 'Partner']
+        is_privileged()
     )
 
 def delete_comment_handler(comment_id: str):
     """Handle comment deletion"""
     if delete_comment(comment_id):
+        _entity_comments_for.clear()
         st.success("Comment deleted!")
         st.rerun()
     else:
         st.error("Failed to delete comment.")
 
-def get_replies(parent_id: str, all_comments: dict) -> list:
-    """Get all replies to a comment, sorted by date"""
-    replies = [
-        (cid, comment) for cid, comment in all_comments.items()
-        if comment.get('parent_id') == parent_id
-    ]
+def group_comments(all_comments: list) -> tuple:
+    """
+    Split comments into root comments and replies grouped by parent, in a single pass
     
-    return sorted(
-        replies,
-        key=lambda x: parse_timestamp(x[1].get('created_at'))
-    )
+    Expects comments already ordered newest first, as returned by
+    get_entity_comments_from_db, so no sorting is needed here.
+    
+    Returns:
+        tuple: (list of (comment_id, comment) roots, newest first,
+                dict of parent_id -> list of (comment_id, comment), oldest first)
+    """
+    root_comments = []
+    replies_index = defaultdict(list)
+    for comment in all_comments:
+        entry = (comment['id'], comment)
+        parent_id = comment.get('parent_id')
+        if parent_id:
+            replies_index[parent_id].append(entry)
+        else:
+            root_comments.append(entry)
+    
+    # Replies read oldest first; flip each newest-first bucket
+    for replies in replies_index.values():
+        replies.reverse()
+    
+    return root_comments, dict(replies_index)
 
 # ============================================================================
 # DEBUG FUNCTIONS (OPTIONAL)
 # ============================================================================
 
-def show_debug_panel(entity_type: str, entity_id: str, file_owner: str, file_name: str, entity_name: str):
+def show_debug_panel(entity_type: str, entity_id: str, file_owner: str, file_name: str, entity_name: str,
+                     owner_email: str = None):
     """Show debug information panel"""
     with st.expander("🔍 Debug Information", expanded=False):
         col1, col2, col3 = st.columns(3)
@@ -801,5 +948,4 @@ def show_debug_panel(entity_type: str, entity_id: str, file_owner: str, file_nam
             is_different = file_owner != st.session_state.current_user if file_owner else False
             st.code(f"Different User: {is_different}")
             
-            owner_email = get_user_email(file_owner) if file_owner else None
             st.code(f"Owner Email: {owner_email or 'None'}")
\ No newline at end of file
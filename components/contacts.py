@@ -8,6 +8,24 @@ from datetime import datetime
 from database import save_contact, delete_contact
 from utils import can_manage_contacts
 
+# Contact field -> table heading, in display order
+CONTACT_DISPLAY_COLUMNS = {
+    'name': 'Name',
+    'organization': 'Organization',
+    'title': 'Title',
+    'email': 'Email',
+    'telephone': 'Telephone',
+    'comments': 'Comments',
+    'added_by': 'Added By',
+    'created_at': 'Added On',
+}
+
+def _build_contacts_df(file_contacts: dict) -> pd.DataFrame:
+    """Build the display table for a file's contacts"""
+    df = pd.DataFrame.from_dict(file_contacts, orient='index').reindex(columns=list(CONTACT_DISPLAY_COLUMNS))
+    df['created_at'] = pd.to_datetime(df['created_at'], utc=True).dt.strftime('%Y-%m-%d')
+    return df.rename(columns=CONTACT_DISPLAY_COLUMNS)
+
 def show_contacts_section(file_id: str, problem_file: dict):
     """Display contacts section for a problem file"""
     st.markdown("### 📇 Contact List")
@@ -16,10 +34,7 @@ def show_contacts_section(file_id: str, problem_file: dict):
     can_manage = can_manage_contacts(problem_file['owner'])
     
     # Get contacts for this file
-    file_contacts = {}
-    for contact_id, contact in st.session_state.data.get('contacts', {}).items():
-        if contact['problem_file_id'] == file_id:
-            file_contacts[contact_id] = contact
+    file_contacts = st.session_state.contacts_by_file.get(file_id, {})
     
     # Add new contact form (only if user can manage)
     if can_manage:
@@ -54,6 +69,7 @@ def show_contacts_section(file_id: str, problem_file: dict):
                         
                         if save_contact(contact_id, contact_data):
                             st.session_state.data['contacts'][contact_id] = contact_data
+                            st.session_state.contacts_by_file.setdefault(file_id, {})[contact_id] = contact_data
                             st.success("Contact added successfully!")
                             st.rerun()
                     else:
@@ -61,34 +77,20 @@ def show_contacts_section(file_id: str, problem_file: dict):
     
     # Display contacts
     if file_contacts:
-        # Create DataFrame for display
-        contacts_list = []
-        for contact_id, contact in file_contacts.items():
-            contacts_list.append({
-                'ID': contact_id,
-                'Name': contact['name'],
-                'Organization': contact.get('organization', ''),
-                'Title': contact.get('title', ''),
-                'Email': contact.get('email', ''),
-                'Telephone': contact.get('telephone', ''),
-                'Comments': contact.get('comments', ''),
-                'Added By': contact.get('added_by', ''),
-                'Added On': contact['created_at'].strftime('%Y-%m-%d')
-            })
-        
-        df_contacts = pd.DataFrame(contacts_list)
-        
-        # Display contacts table
-        st.dataframe(df_contacts.drop('ID', axis=1), use_container_width=True)
+        # Display contacts table; the contacts dict itself is the cache key
+        st.dataframe(_build_contacts_df(file_contacts), hide_index=True, use_container_width=True)
         
         # Edit/Delete contacts (only if user can manage)
         if can_manage:
             st.markdown("#### Manage Contacts")
             
+            # Labels resolved once; None is the placeholder option
+            contact_names = {None: "Select..."}
+            contact_names.update((cid, c['name']) for cid, c in file_contacts.items())
             contact_to_manage = st.selectbox(
                 "Select contact to edit/delete:",
-                options=[None] + list(file_contacts.keys()),
-                format_func=lambda x: "Select..." if x is None else file_contacts[x]['name'],
+                options=list(contact_names),
+                format_func=contact_names.__getitem__,
                 key=f"manage_contact_{file_id}"
             )
             
@@ -132,6 +134,7 @@ def show_contacts_section(file_id: str, problem_file: dict):
                         if st.form_submit_button("Delete Contact", type="secondary"):
                             if delete_contact(contact_to_manage):
                                 del st.session_state.data['contacts'][contact_to_manage]
+                                del file_contacts[contact_to_manage]
                                 st.success("Contact deleted!")
                                 st.rerun()
     else:
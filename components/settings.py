@@ -2,11 +2,21 @@
 File settings component with email status and timeline management
 """
 import streamlit as st
+import pandas as pd
 from datetime import datetime, timedelta
 from database import save_problem_file
+from utils import is_privileged, to_midnight, count_file_comments, count_file_contacts
 
-def is_email_configured():
-    """Check if email is properly configured"""
+def _subtask_bounds_df(subtask_rows: list) -> pd.DataFrame:
+    """Build a (label, start, end) frame of subtask dates for vectorized boundary checks"""
+    df = pd.DataFrame(subtask_rows, columns=['label', 'start', 'end'])
+    df['start'] = pd.to_datetime(df['start'])
+    df['end'] = pd.to_datetime(df['end'])
+    return df
+
+@st.cache_resource
+def _email_configured() -> bool:
+    """Resolve email configuration once per process; secrets don't change at runtime"""
     try:
         # Import here to avoid circular dependency
         from email_handler import is_email_configured as check_email
@@ -14,6 +24,10 @@ def is_email_configured():
     except:
         return False
 
+def is_email_configured():
+    """Check if email is properly configured"""
+    return _email_configured()
+
 def show_file_settings(file_id, problem_file, can_edit):
     """Display file settings tab with timeline management"""
     st.subheader("⚙️ File Settings")
@@ -30,7 +44,7 @@ def show_file_settings(file_id, problem_file, can_edit):
             with col1:
                 new_name = st.text_input("Problem Name", value=problem_file['problem_name'])
                 # Only admin and partner can change owner
-                if st.session_state.user_role in ['Admin', 'Partner']:
+                if is_privileged():
                     new_owner = st.selectbox("Owner", st.session_state.data['users'], 
                                             index=st.session_state.data['users'].index(problem_file['owner']))
                 else:
@@ -56,33 +70,43 @@ def show_file_settings(file_id, problem_file, can_edit):
             st.info(f"📅 Project Duration: {duration} days")
             
             # Check if any tasks would fall outside new boundaries
-            tasks_outside = []
-            for task in problem_file.get('tasks', {}).values():
-                for subtask in task.get('subtasks', {}).values():
-                    if (subtask['start_date'].date() < new_start_date or 
-                        subtask['projected_end_date'].date() > new_end_date):
-                        tasks_outside.append(f"{task['name']} - {subtask['name']}")
+            subtask_rows = [
+                (f"{task['name']} - {subtask['name']}",
+                 subtask['start_date'].date(),
+                 subtask['projected_end_date'].date())
+                for task in problem_file.get('tasks', {}).values()
+                for subtask in task.get('subtasks', {}).values()
+            ]
+            outside_count = 0
+            if subtask_rows:
+                bounds = _subtask_bounds_df(subtask_rows)
+                outside = (bounds['start'] < pd.Timestamp(new_start_date)) | (bounds['end'] > pd.Timestamp(new_end_date))
+                outside_count = int(outside.sum())
             
-            if tasks_outside:
+            if outside_count:
                 st.error("⚠️ The following tasks would fall outside the new project dates:")
-                for task_name in tasks_outside[:5]:  # Show first 5
+                # Only the first 5 labels are shown, so only those are materialized
+                for task_name in bounds.loc[outside, 'label'].head(5):
                     st.write(f"  • {task_name}")
-                if len(tasks_outside) > 5:
-                    st.write(f"  ... and {len(tasks_outside) - 5} more")
+                if outside_count > 5:
+                    st.write(f"  ... and {outside_count - 5} more")
                 st.warning("Please adjust task dates before changing project boundaries.")
             
             if st.form_submit_button("Update Settings"):
-                if tasks_outside:
+                if outside_count:
                     st.error("Cannot update: Some tasks are outside the new project boundaries!")
                 else:
                     problem_file['problem_name'] = new_name
                     problem_file['owner'] = new_owner
-                    problem_file['project_start_date'] = datetime.combine(new_start_date, datetime.min.time())
-                    problem_file['project_end_date'] = datetime.combine(new_end_date, datetime.min.time())
+                    problem_file['project_start_date'] = to_midnight(new_start_date)
+                    problem_file['project_end_date'] = to_midnight(new_end_date)
                     problem_file['display_week'] = new_display_week
                     problem_file['last_modified'] = datetime.now()
                     
                     if save_problem_file(file_id, problem_file):
+                        # Owner/name may have changed; drop cached comment lookups
+                        from components.comments import invalidate_file_owner
+                        invalidate_file_owner()
                         st.success("Settings updated successfully!")
                         # Update the page title in session state
                         st.session_state.page = f"📁 {new_name}"
@@ -110,36 +134,24 @@ def show_file_settings(file_id, problem_file, can_edit):
     st.subheader("📋 File Information")
     col1, col2 = st.columns(2)
     with col1:
-        created_date = problem_file.get('created_date', 'Unknown')
-        if hasattr(created_date, 'strftime'):
-            created_str = created_date.strftime('%Y-%m-%d %H:%M')
-        else:
-            created_str = str(created_date)
+        # load_data and file creation always store datetimes here
+        created_date = problem_file.get('created_date')
+        created_str = created_date.strftime('%Y-%m-%d %H:%M') if created_date else 'Unknown'
         st.write(f"**Created:** {created_str}")
         st.write(f"**Total Tasks:** {len(problem_file.get('tasks', {}))}")
         
         # Count total comments
-        total_comments = 0
-        for task_id in problem_file.get('tasks', {}):
-            total_comments += len([c for c in st.session_state.data.get('comments', {}).values() 
-                                 if c['entity_type'] == 'task' and c['entity_id'] == task_id])
-            for subtask_id in problem_file.get('tasks', {}).get(task_id, {}).get('subtasks', {}):
-                total_comments += len([c for c in st.session_state.data.get('comments', {}).values() 
-                                     if c['entity_type'] == 'subtask' and c['entity_id'] == subtask_id])
+        total_comments = count_file_comments(problem_file)
         st.write(f"**Total Comments:** {total_comments}")
     
     with col2:
-        last_modified = problem_file.get('last_modified', 'Unknown')
-        if hasattr(last_modified, 'strftime'):
-            modified_str = last_modified.strftime('%Y-%m-%d %H:%M')
-        else:
-            modified_str = str(last_modified)
+        last_modified = problem_file.get('last_modified')
+        modified_str = last_modified.strftime('%Y-%m-%d %H:%M') if last_modified else 'Unknown'
         st.write(f"**Last Modified:** {modified_str}")
         
         total_subtasks = sum(len(task.get('subtasks', {})) for task in problem_file.get('tasks', {}).values())
         st.write(f"**Total Subtasks:** {total_subtasks}")
         
         # Count contacts
-        contacts_count = len([c for c in st.session_state.data.get('contacts', {}).values() 
-                            if c['problem_file_id'] == file_id])
+        contacts_count = count_file_contacts(file_id)
         st.write(f"**Total Contacts:** {contacts_count}")
\ No newline at end of file
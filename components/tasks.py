@@ -5,10 +5,18 @@ import streamlit as st
 import pandas as pd
 import uuid
 from datetime import datetime, timedelta
-from database import save_task, save_subtask, delete_task, delete_subtask
-from utils import calculate_task_progress, can_delete_items
+from database import save_task, save_subtask, save_subtasks, delete_task, delete_subtask
+from utils import calculate_task_progress, can_delete_items, is_privileged, to_midnight
 from components.comments import show_comments_section
 
+SUBTASK_COLUMN_CONFIG = {
+    'Name': st.column_config.TextColumn(required=True),
+    'Progress': st.column_config.NumberColumn(min_value=0, max_value=100, step=1, format="%d%%",
+                                              required=True, default=0),
+    'Start Date': st.column_config.DateColumn(format="YYYY-MM-DD", required=True),
+    'End Date': st.column_config.DateColumn(format="YYYY-MM-DD", required=True),
+}
+
 def show_task_management(file_id, problem_file, can_edit):
     """Display task management interface"""
     
@@ -40,36 +48,63 @@ def show_task_management(file_id, problem_file, can_edit):
         st.info("No tasks yet. Add your first task above!")
         return
     
-    for task_id, task in problem_file['tasks'].items():
-        with st.expander(f"📂 {task['name']}", expanded=True):
-            
-            # Task header with progress and delete option
-            col1, col2 = st.columns([4, 1])
-            with col1:
-                st.write(f"**Description:** {task.get('description', 'No description')}")
-                task_progress = calculate_task_progress(task['subtasks'])
-                st.progress(task_progress / 100, text=f"Task Progress: {task_progress:.1f}%")
-            with col2:
-                if can_edit and can_delete_items():
-                    if st.button("🗑️ Delete Task", key=f"delete_task_{task_id}"):
-                        if delete_task(task_id):
-                            del problem_file['tasks'][task_id]
-                            st.success("Task deleted!")
-                            st.rerun()
-            
-            # Comments section for task
-            with st.expander(f"💬 Task Comments"):
-                show_comments_section('task', task_id, task['name'])
-            
-            # Add subtask form (only if can edit)
-            if can_edit:
-                show_add_subtask_form(task_id, task, file_id)
-            
-            # Display existing subtasks
-            if task['subtasks']:
-                show_subtasks_table(task_id, task, problem_file, can_edit)
-            else:
-                st.info("No subtasks yet. Add subtasks to start tracking progress!")
+    # Resolve the delete permission once rather than in every task block
+    can_delete = can_edit and can_delete_items()
+    for task_id, task in list(problem_file['tasks'].items()):
+        _render_task(task_id, task, file_id, problem_file, can_edit, can_delete)
+
+def _toggle_task(task_id):
+    """Flip a task between open and collapsed before the fragment reruns"""
+    task_open = st.session_state.task_open
+    task_open[task_id] = not task_open.get(task_id, True)
+
+@st.fragment
+def _render_task(task_id, task, file_id, problem_file, can_edit, can_delete):
+    """Render one task block; widget interactions rerun only this task"""
+    # st.expander runs its body even when collapsed, so track open state ourselves
+    # and skip building the task body entirely for collapsed tasks
+    is_open = st.session_state.setdefault('task_open', {}).get(task_id, True)
+    
+    with st.container(border=True):
+        header_col, toggle_col = st.columns([12, 1])
+        with header_col:
+            st.markdown(f"**📂 {task['name']}**")
+        with toggle_col:
+            st.button("▼" if is_open else "▶", key=f"toggle_task_{task_id}",
+                      on_click=_toggle_task, args=(task_id,))
+        
+        if not is_open:
+            return
+        
+        # Task header with progress and delete option
+        col1, col2 = st.columns([4, 1])
+        with col1:
+            st.write(f"**Description:** {task.get('description', 'No description')}")
+            task_progress = calculate_task_progress(task['subtasks'])
+            st.progress(task_progress / 100, text=f"Task Progress: {task_progress:.1f}%")
+        with col2:
+            if can_delete:
+                if st.button("🗑️ Delete Task", key=f"delete_task_{task_id}"):
+                    if delete_task(task_id):
+                        del problem_file['tasks'][task_id]
+                        st.success("Task deleted!")
+                        st.rerun()
+        
+        # Comments section for task
+        with st.expander(f"💬 Task Comments"):
+            show_comments_section('task', task_id, task['name'],
+                                  file_owner=problem_file['owner'],
+                                  file_name=problem_file['problem_name'])
+        
+        # Add subtask form (only if can edit)
+        if can_edit:
+            show_add_subtask_form(task_id, task, file_id)
+        
+        # Display existing subtasks
+        if task['subtasks']:
+            show_subtasks_table(task_id, task, problem_file, can_edit)
+        else:
+            st.info("No subtasks yet. Add subtasks to start tracking progress!")
 
 def show_add_subtask_form(task_id, task, file_id):
     """Display add subtask form"""
@@ -95,8 +130,8 @@ def show_add_subtask_form(task_id, task, file_id):
                 subtask_data = {
                     'name': subtask_name,
                     'assigned_to': assigned_to,
-                    'start_date': datetime.combine(start_date, datetime.min.time()),
-                    'projected_end_date': datetime.combine(end_date, datetime.min.time()),
+                    'start_date': to_midnight(start_date),
+                    'projected_end_date': to_midnight(end_date),
                     'progress': progress,
                     'notes': notes
                 }
@@ -114,30 +149,51 @@ def show_subtasks_table(task_id, task, problem_file, can_edit):
     """Display subtasks table with edit capabilities"""
     st.write("**Existing Subtasks:**")
     
-    subtask_data = []
-    for subtask_id, subtask in task['subtasks'].items():
-        is_overdue = (subtask['projected_end_date'].date() < datetime.now().date() and 
-                    subtask['progress'] < 100)
-        
-        subtask_data.append({
-            'ID': subtask_id,
-            'Name': subtask['name'],
-            'Assigned To': subtask['assigned_to'],
-            'Progress': f"{subtask['progress']}%",
-            'Start Date': subtask['start_date'].strftime('%Y-%m-%d'),
-            'End Date': subtask['projected_end_date'].strftime('%Y-%m-%d'),
-            'Status': '🔴 Overdue' if is_overdue else '🟢 On Track',
-            'Notes': subtask['notes'][:50] + '...' if len(subtask['notes']) > 50 else subtask['notes']
-        })
+    # Raw values indexed by subtask id; display formatting is left to column_config
+    df_subtasks = pd.DataFrame.from_records(
+        [(subtask_id, subtask['name'], subtask['assigned_to'], subtask['progress'],
+          subtask['start_date'], subtask['projected_end_date'], subtask['notes'])
+         for subtask_id, subtask in task['subtasks'].items()],
+        columns=['ID', 'Name', 'Assigned To', 'Progress', 'Start Date', 'End Date', 'Notes'],
+        index='ID'
+    )
+    end_ts = pd.to_datetime(df_subtasks['End Date'], utc=True)
+    # Compare on the datetime64 column; the date objects below only feed DateColumn
+    is_overdue = (end_ts.dt.normalize() < pd.Timestamp(datetime.now().date(), tz='UTC')) & (df_subtasks['Progress'] < 100)
+    df_subtasks['Start Date'] = pd.to_datetime(df_subtasks['Start Date'], utc=True).dt.date
+    df_subtasks['End Date'] = end_ts.dt.date
+    df_subtasks.insert(5, 'Status', is_overdue.map({True: '🔴 Overdue', False: '🟢 On Track'}))
     
-    df_subtasks = pd.DataFrame(subtask_data)
-    st.dataframe(df_subtasks.drop('ID', axis=1), use_container_width=True)
+    if can_edit:
+        # Edit in place; Streamlit keeps only the changed cells in the widget state
+        editor_key = f"subtasks_editor_{task_id}"
+        edited = st.data_editor(
+            df_subtasks,
+            key=editor_key,
+            hide_index=True,
+            use_container_width=True,
+            disabled=['Status'],
+            column_config={
+                **SUBTASK_COLUMN_CONFIG,
+                'Assigned To': st.column_config.SelectboxColumn(
+                    options=st.session_state.data['users'], required=True),
+            },
+        )
+        changed_rows = st.session_state[editor_key]['edited_rows']
+        if changed_rows and st.button("💾 Save Changes", key=f"save_subtasks_{task_id}"):
+            save_subtask_edits(task_id, task, problem_file, edited.iloc[sorted(changed_rows)])
+    else:
+        st.dataframe(df_subtasks, hide_index=True, use_container_width=True,
+                     column_config=SUBTASK_COLUMN_CONFIG)
     
     # Select subtask for editing or viewing comments
+    # Labels resolved once; None is the placeholder option
+    subtask_names = {None: "Select..."}
+    subtask_names.update((sid, s['name']) for sid, s in task['subtasks'].items())
     subtask_to_manage = st.selectbox(
         f"Select subtask to manage:",
-        options=[None] + list(task['subtasks'].keys()),
-        format_func=lambda x: "Select..." if x is None else task['subtasks'][x]['name'],
+        options=list(subtask_names),
+        format_func=subtask_names.__getitem__,
         key=f"manage_select_{task_id}"
     )
     
@@ -151,15 +207,52 @@ def show_subtasks_table(task_id, task, problem_file, can_edit):
             show_edit_subtask_form(task_id, subtask_to_manage, task, problem_file, can_edit)
         
         with subtask_tabs[1]:
-            show_comments_section('subtask', subtask_to_manage, subtask['name'])
+            show_comments_section('subtask', subtask_to_manage, subtask['name'],
+                                  file_owner=problem_file['owner'],
+                                  file_name=problem_file['problem_name'])
+
+def save_subtask_edits(task_id, task, problem_file, changed_rows):
+    """Persist the rows changed in the subtasks editor in one round-trip"""
+    # Cleared cells come back as NaN/None; skip those rows instead of saving them
+    valid = (changed_rows['Name'].fillna('').astype(str).str.strip().ne('')
+             & changed_rows[['Assigned To', 'Progress', 'Start Date', 'End Date']].notna().all(axis=1))
+    skipped = changed_rows.index[~valid]
+    if len(skipped):
+        st.error("Not saved - name, assignee, progress and dates are required: "
+                 + ", ".join(task['subtasks'][subtask_id]['name'] for subtask_id in skipped))
+        changed_rows = changed_rows[valid]
+        if changed_rows.empty:
+            return
+    
+    updates = {
+        subtask_id: dict(task['subtasks'][subtask_id],
+                         name=row['Name'],
+                         assigned_to=row['Assigned To'],
+                         progress=int(row['Progress']),
+                         start_date=to_midnight(row['Start Date']),
+                         projected_end_date=to_midnight(row['End Date']),
+                         notes=row['Notes'] if pd.notna(row['Notes']) else '')
+        for subtask_id, row in changed_rows.iterrows()
+    }
+    
+    if save_subtasks(task_id, updates):
+        for subtask_id, updated in updates.items():
+            task['subtasks'][subtask_id].update(updated)
+        problem_file['last_modified'] = datetime.now()
+        st.success("Subtasks updated!")
+        # Keep the skipped-rows error on screen instead of rerunning it away
+        if not len(skipped):
+            st.rerun()
+    else:
+        st.error("Failed to update subtasks.")
 
 def show_edit_subtask_form(task_id, subtask_id, task, problem_file, can_edit_param):
     """Display edit subtask form"""
     subtask = task['subtasks'][subtask_id]
     
     # Check if user can edit this specific subtask
-    can_edit_subtask = (st.session_state.user_role in ['Admin', 'Partner'] or 
-                       problem_file['owner'] == st.session_state.current_user or
+    can_reassign = is_privileged() or problem_file['owner'] == st.session_state.current_user
+    can_edit_subtask = (can_reassign or
                        subtask['assigned_to'] == st.session_state.current_user)
     
     if not can_edit_subtask:
@@ -172,7 +265,7 @@ def show_edit_subtask_form(task_id, subtask_id, task, problem_file, can_edit_par
         with ecol1:
             new_subtask_name = st.text_input("Subtask Name", value=subtask['name'])
             # Only admin, partner and owner can reassign tasks
-            if st.session_state.user_role in ['Admin', 'Partner'] or problem_file['owner'] == st.session_state.current_user:
+            if can_reassign:
                 new_assigned_to = st.selectbox("Assigned To", st.session_state.data['users'],
                                              index=st.session_state.data['users'].index(subtask['assigned_to']))
             else:
@@ -191,8 +284,8 @@ def show_edit_subtask_form(task_id, subtask_id, task, problem_file, can_edit_par
             if st.form_submit_button("Update Subtask"):
                 subtask['name'] = new_subtask_name
                 subtask['assigned_to'] = new_assigned_to
-                subtask['start_date'] = datetime.combine(new_start_date, datetime.min.time())
-                subtask['projected_end_date'] = datetime.combine(new_end_date, datetime.min.time())
+                subtask['start_date'] = to_midnight(new_start_date)
+                subtask['projected_end_date'] = to_midnight(new_end_date)
                 subtask['progress'] = new_progress
                 subtask['notes'] = new_notes
                 
@@ -2,12 +2,31 @@
 Visualization components for enhanced Gantt charts and analytics
 """
 import streamlit as st
+import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime, timedelta
 
-def create_gantt_chart(problem_file):
+# Gantt bar colors, in legend order
+STATUS_COLORS = {
+    'Complete': '#28a745',
+    'In Progress': '#ffc107',
+    'Not Started': '#6c757d',
+    'Overdue': '#dc3545'
+}
+
+# Above this many subtasks the Gantt chart shows weekly per-assignee bars by default
+GANTT_DETAIL_LIMIT = 500
+
+def file_subtasks(file_id) -> pd.DataFrame:
+    """Rows of the session's columnar subtask frame belonging to one problem file"""
+    subtasks_df = st.session_state.data.get('subtasks_df')
+    if subtasks_df is None:
+        return pd.DataFrame()
+    return subtasks_df[subtasks_df['file_id'] == file_id]
+
+def create_gantt_chart(problem_file, file_id, summarize=False):
     """Create enhanced Gantt chart with boundaries and visual improvements"""
     try:
         # Get project dates with fallbacks
@@ -24,152 +43,191 @@ def create_gantt_chart(problem_file):
         if not isinstance(project_end, datetime):
             project_end = project_start + timedelta(days=30)
         
-        # Collect task data
-        tasks_data = []
-        for task_id, task in problem_file.get('tasks', {}).items():
-            for subtask_id, subtask in task.get('subtasks', {}).items():
-                # Determine status and color
-                is_overdue = (subtask['projected_end_date'].date() < datetime.now().date() and 
-                             subtask['progress'] < 100)
-                
-                within_bounds = (project_start.date() <= subtask['start_date'].date() <= project_end.date() and
-                               project_start.date() <= subtask['projected_end_date'].date() <= project_end.date())
-                
-                if subtask['progress'] == 100:
-                    color = 'Complete'
-                elif is_overdue:
-                    color = 'Overdue'
-                elif subtask['progress'] > 0:
-                    color = 'In Progress'
-                else:
-                    color = 'Not Started'
-                
-                tasks_data.append({
-                    'Task': f"{task['name']} - {subtask['name']}",
-                    'Start': subtask['start_date'].strftime('%Y-%m-%d'),
-                    'Finish': subtask['projected_end_date'].strftime('%Y-%m-%d'),
-                    'Resource': subtask['assigned_to'],
-                    'Progress': subtask['progress'],
-                    'Status': color,
-                    'Within Bounds': 'Yes' if within_bounds else 'No'
-                })
-        
-        if not tasks_data:
+        # Only the charted columns, so the figure build below is cached on them
+        gantt_rows = file_subtasks(file_id)
+        if gantt_rows.empty:
             return None
+        gantt_rows = gantt_rows[['task_name', 'name', 'start_date', 'projected_end_date',
+                                 'assigned_to', 'progress']].reset_index(drop=True)
         
-        # Create DataFrame
-        df = pd.DataFrame(tasks_data)
-        
-        # Define color mapping
-        color_map = {
-            'Complete': '#28a745',
-            'In Progress': '#ffc107',
-            'Not Started': '#6c757d',
-            'Overdue': '#dc3545'
-        }
-        
-        # Create Gantt chart using plotly express
-        fig = px.timeline(
-            df,
-            x_start='Start',
-            x_end='Finish',
-            y='Task',
-            color='Status',
-            color_discrete_map=color_map,
-            hover_data=['Resource', 'Progress', 'Within Bounds'],
-            title=f"Gantt Chart - {problem_file['problem_name']}"
-        )
-        
-        # Update layout
-        fig.update_layout(
-            height=max(400, len(tasks_data) * 50),
-            xaxis_title="Timeline",
-            yaxis_title="Tasks",
-            showlegend=True,
-            hovermode='closest'
-        )
-        
-        # Reverse y-axis to show tasks from top to bottom
-        fig.update_yaxes(autorange="reversed")
-        
-        # Add reference lines as shapes (not vlines)
-        # Project start line
-        fig.add_shape(
-            type="line",
-            x0=project_start.strftime('%Y-%m-%d'),
-            y0=0,
-            x1=project_start.strftime('%Y-%m-%d'),
-            y1=1,
-            xref="x",
-            yref="paper",
-            line=dict(color="blue", width=2, dash="dash"),
-        )
-        
-        # Project end line
-        fig.add_shape(
-            type="line",
-            x0=project_end.strftime('%Y-%m-%d'),
-            y0=0,
-            x1=project_end.strftime('%Y-%m-%d'),
-            y1=1,
-            xref="x",
-            yref="paper",
-            line=dict(color="blue", width=2, dash="dash"),
-        )
-        
-        # Today line
-        fig.add_shape(
-            type="line",
-            x0=datetime.now().strftime('%Y-%m-%d'),
-            y0=0,
-            x1=datetime.now().strftime('%Y-%m-%d'),
-            y1=1,
-            xref="x",
-            yref="paper",
-            line=dict(color="red", width=2, dash="solid"),
-        )
-        
-        # Add annotations for the reference lines
-        fig.add_annotation(
-            x=project_start.strftime('%Y-%m-%d'),
-            y=1.05,
-            text="Project Start",
-            showarrow=False,
-            xref="x",
-            yref="paper",
-            font=dict(size=10, color="blue"),
-            xanchor="center"
-        )
-        
-        fig.add_annotation(
-            x=project_end.strftime('%Y-%m-%d'),
-            y=1.05,
-            text="Project End",
-            showarrow=False,
-            xref="x",
-            yref="paper",
-            font=dict(size=10, color="blue"),
-            xanchor="center"
-        )
-        
-        fig.add_annotation(
-            x=datetime.now().strftime('%Y-%m-%d'),
-            y=-0.05,
-            text="Today",
-            showarrow=False,
-            xref="x",
-            yref="paper",
-            font=dict(size=10, color="red"),
-            xanchor="center"
-        )
-        
-        return fig
+        return _build_gantt_fig(gantt_rows, project_start, project_end,
+                                problem_file['problem_name'], datetime.now().date(), summarize)
         
     except Exception as e:
         st.error(f"Error creating Gantt chart: {str(e)}")
         return None
 
-def show_gantt_chart_tab(problem_file):
+def _gantt_frame(gantt_rows: pd.DataFrame, project_start, project_end, today) -> pd.DataFrame:
+    """Turn subtask columns into Gantt columns with status and bounds computed column-wise"""
+    start_days = gantt_rows['start_date'].dt.normalize()
+    end_days = gantt_rows['projected_end_date'].dt.normalize()
+    progress = gantt_rows['progress'].to_numpy()
+    
+    first_day = pd.Timestamp(project_start.date(), tz='UTC')
+    last_day = pd.Timestamp(project_end.date(), tz='UTC')
+    is_overdue = (end_days < pd.Timestamp(today, tz='UTC')) & (progress < 100)
+    within_bounds = ((start_days >= first_day) & (start_days <= last_day) &
+                     (end_days >= first_day) & (end_days <= last_day))
+    
+    return pd.DataFrame({
+        'Task': gantt_rows['task_name'] + ' - ' + gantt_rows['name'],
+        'start': start_days,
+        'end': end_days,
+        'Resource': gantt_rows['assigned_to'],
+        'Progress': progress,
+        'Status': np.select([progress == 100, is_overdue, progress > 0],
+                            ['Complete', 'Overdue', 'In Progress'], default='Not Started'),
+        'within': within_bounds,
+    })
+
+def _summarize_gantt_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Collapse subtasks into one bar per (start week, assignee, status)"""
+    week = (df['start'] - pd.to_timedelta(df['start'].dt.weekday, unit='D')).rename('week')
+    summary = df.groupby([week, 'Resource', 'Status'], sort=True).agg(
+        count=('Task', 'size'),
+        start=('start', 'min'),
+        end=('end', 'max'),
+        Progress=('Progress', 'mean'),
+        within=('within', 'all'),
+    ).reset_index()
+    summary['Progress'] = summary['Progress'].round().astype(int)
+    summary['Task'] = ("Week of " + summary['week'].dt.strftime('%Y-%m-%d') + " · " +
+                       summary['Resource'] + " (" + summary['count'].astype(str) + ")")
+    return summary
+
+@st.cache_data(ttl=3600, max_entries=64, show_spinner=False)
+def _build_gantt_fig(gantt_rows: pd.DataFrame, project_start, project_end, problem_name: str, today,
+                     summarize: bool = False):
+    """
+    Build the Gantt figure from a file's subtask columns
+    
+    Cached on its arguments, so reruns triggered by unrelated widgets reuse the
+    figure until a subtask, the project bounds or the current day changes.
+    With summarize, subtasks are grouped into weekly per-assignee bars so very
+    large projects render a bounded number of bars.
+    """
+    df = _gantt_frame(gantt_rows, project_start, project_end, today)
+    if summarize:
+        df = _summarize_gantt_frame(df)
+    
+    start_strs = df['start'].dt.strftime('%Y-%m-%d').to_numpy()
+    end_strs = df['end'].dt.strftime('%Y-%m-%d').to_numpy()
+    durations_ms = ((df['end'] - df['start']) / pd.Timedelta(milliseconds=1)).to_numpy()
+    statuses = df['Status'].to_numpy()
+    hover = np.stack([start_strs, end_strs, df['Resource'].to_numpy(dtype=object),
+                      df['Progress'].to_numpy(), np.where(df['within'], 'Yes', 'No')], axis=-1)
+    labels = df['Task'].to_numpy(dtype=object)
+    
+    # One horizontal bar trace per status, as px.timeline would produce, built directly
+    fig = go.Figure()
+    for status, color in STATUS_COLORS.items():
+        mask = statuses == status
+        if not mask.any():
+            continue
+        fig.add_trace(go.Bar(
+            name=status,
+            orientation='h',
+            base=start_strs[mask],
+            x=durations_ms[mask],
+            y=labels[mask],
+            marker_color=color,
+            customdata=hover[mask],
+            hovertemplate=(
+                "<b>%{y}</b><br>Start: %{customdata[0]}<br>Finish: %{customdata[1]}"
+                "<br>Resource: %{customdata[2]}<br>Progress: %{customdata[3]}"
+                "<br>Within Bounds: %{customdata[4]}<extra>" + status + "</extra>"
+            ),
+        ))
+    
+    # Reference dates formatted once for the lines and labels below
+    start_str = project_start.date().isoformat()
+    end_str = project_end.date().isoformat()
+    today_str = today.isoformat()
+    
+    # Project start, project end and today lines with their labels (shapes, not vlines)
+    reference_lines = [
+        (start_str, "Project Start", "blue", "dash", 1.05),
+        (end_str, "Project End", "blue", "dash", 1.05),
+        (today_str, "Today", "red", "solid", -0.05),
+    ]
+    shapes = [
+        dict(type="line", x0=x, y0=0, x1=x, y1=1, xref="x", yref="paper",
+             line=dict(color=color, width=2, dash=dash))
+        for x, _, color, dash, _ in reference_lines
+    ]
+    annotations = [
+        dict(x=x, y=label_y, text=text, showarrow=False, xref="x", yref="paper",
+             font=dict(size=10, color=color), xanchor="center")
+        for x, text, color, _, label_y in reference_lines
+    ]
+    
+    # Whole layout, reference lines included, in one update
+    fig.update_layout(
+        title=f"Gantt Chart - {problem_name}",
+        height=max(400, len(labels) * 50),
+        barmode='overlay',
+        xaxis=dict(type='date', title="Timeline"),
+        # Keep rows in subtask order rather than trace order, top to bottom
+        yaxis=dict(title="Tasks", categoryorder='array', categoryarray=list(dict.fromkeys(labels)),
+                   autorange="reversed"),
+        showlegend=True,
+        hovermode='closest',
+        shapes=shapes,
+        annotations=annotations
+    )
+    
+    return fig
+
+def project_stats(file_id) -> dict:
+    """Aggregate subtask status, workload and date range for a problem file"""
+    stat_rows = file_subtasks(file_id)
+    if not stat_rows.empty:
+        stat_rows = stat_rows[['assigned_to', 'progress', 'start_date',
+                               'projected_end_date']].reset_index(drop=True)
+    return _compute_project_stats(stat_rows, datetime.now().date())
+
+@st.cache_data(ttl=3600, max_entries=64, show_spinner=False)
+def _compute_project_stats(stat_rows: pd.DataFrame, today) -> dict:
+    """
+    Vectorized aggregates over assigned_to, progress, start and end columns
+    
+    Shared by the Gantt insights and the analytics tab so both read one set of
+    aggregates instead of each walking the subtasks again.
+    """
+    if stat_rows.empty:
+        return {'completed': 0, 'in_progress': 0, 'not_started': 0, 'overdue': 0,
+                'progress': np.empty(0, dtype=np.int16), 'workload': pd.DataFrame(),
+                'first_date': None, 'last_date': None}
+    
+    # Boolean masks over the columns do all the counting
+    users = stat_rows['assigned_to'].to_numpy(dtype=object)
+    progress = stat_rows['progress'].to_numpy(dtype=np.int16)
+    start_days = pd.DatetimeIndex(stat_rows['start_date'])
+    end_days = pd.DatetimeIndex(stat_rows['projected_end_date'])
+    
+    completed = progress == 100
+    overdue = (end_days.normalize() < pd.Timestamp(today, tz='UTC')) & (progress < 100)
+    
+    workload = pd.DataFrame({'User': users, 'Completed': completed, 'Overdue': overdue}).groupby(
+        'User', sort=False).agg(**{'Total Tasks': ('Completed', 'size'),
+                                   'Completed': ('Completed', 'sum'),
+                                   'Overdue': ('Overdue', 'sum')}).reset_index()
+    
+    stats = {
+        'completed': int(completed.sum()),
+        'in_progress': int(((progress > 0) & ~completed).sum()),
+        'not_started': int((progress <= 0).sum()),
+        'overdue': int(overdue.sum()),
+        'progress': progress,
+        'workload': workload,
+        'first_date': min(start_days.min(), end_days.min()),
+        'last_date': max(start_days.max(), end_days.max()),
+    }
+    
+    return stats
+
+@st.fragment
+def show_gantt_chart_tab(problem_file, file_id):
     """Display Gantt chart tab"""
     st.subheader("📈 Project Timeline")
     
@@ -178,44 +236,44 @@ def show_gantt_chart_tab(problem_file):
         project_start = problem_file.get('project_start_date', datetime.now())
         problem_file['project_end_date'] = project_start + timedelta(days=30)
     
-    gantt_fig = create_gantt_chart(problem_file)
+    # Past the detail limit, default to the summarized view with an opt-in for every bar
+    subtask_count = len(file_subtasks(file_id))
+    summarize = False
+    if subtask_count > GANTT_DETAIL_LIMIT:
+        summarize = not st.toggle(f"Show all {subtask_count} subtasks", value=False,
+                                  key=f"gantt_show_all_{file_id}")
+        if summarize:
+            st.caption("Large project: subtasks are grouped by start week, assignee and status.")
+    
+    gantt_fig = create_gantt_chart(problem_file, file_id, summarize)
     if gantt_fig:
-        st.plotly_chart(gantt_fig, use_container_width=True)
+        # A stable key lets the frontend reuse the chart element across reruns
+        st.plotly_chart(gantt_fig, use_container_width=True, key=f"gantt_{file_id}")
         
         # Timeline insights
         st.subheader("📊 Timeline Insights")
         
-        # Calculate project duration and other metrics
-        all_dates = []
-        overdue_count = 0
-        completed_count = 0
+        stats = project_stats(file_id)
         
-        for task in problem_file.get('tasks', {}).values():
-            for subtask in task.get('subtasks', {}).values():
-                all_dates.extend([subtask['start_date'], subtask['projected_end_date']])
-                if subtask['progress'] == 100:
-                    completed_count += 1
-                elif subtask['projected_end_date'].date() < datetime.now().date() and subtask['progress'] < 100:
-                    overdue_count += 1
-        
-        if all_dates:
-            project_start = min(all_dates)
-            project_end = max(all_dates)
+        if stats['first_date'] is not None:
+            project_start = stats['first_date']
+            project_end = stats['last_date']
             duration_days = (project_end - project_start).days
             
             col1, col2, col3, col4 = st.columns(4)
             with col1:
                 st.metric("Project Duration", f"{duration_days} days")
             with col2:
-                st.metric("Completed Subtasks", completed_count)
+                st.metric("Completed Subtasks", stats['completed'])
             with col3:
-                st.metric("Overdue Subtasks", overdue_count)
+                st.metric("Overdue Subtasks", stats['overdue'])
             with col4:
                 st.metric("Project End Date", project_end.strftime('%Y-%m-%d'))
     else:
         st.info("No tasks to display in Gantt chart. Add some subtasks first!")
 
-def show_file_analytics(problem_file):
+@st.fragment
+def show_file_analytics(problem_file, file_id):
     """Display file analytics tab"""
     st.subheader("📊 Project Analytics")
     
@@ -224,47 +282,28 @@ def show_file_analytics(problem_file):
         return
     
     # Collect analytics data
-    user_workload = {}
-    progress_data = []
-    status_data = {'Completed': 0, 'In Progress': 0, 'Not Started': 0, 'Overdue': 0}
-    
-    for task in problem_file.get('tasks', {}).values():
-        for subtask in task.get('subtasks', {}).values():
-            # User workload
-            user = subtask['assigned_to']
-            if user not in user_workload:
-                user_workload[user] = {'total': 0, 'completed': 0, 'overdue': 0}
-            user_workload[user]['total'] += 1
-            
-            # Progress tracking
-            progress_data.append(subtask['progress'])
-            
-            # Status tracking
-            if subtask['progress'] == 100:
-                status_data['Completed'] += 1
-                user_workload[user]['completed'] += 1
-            elif subtask['progress'] > 0:
-                status_data['In Progress'] += 1
-            else:
-                status_data['Not Started'] += 1
-            
-            # Check if overdue
-            if (subtask['projected_end_date'].date() < datetime.now().date() and 
-                subtask['progress'] < 100):
-                status_data['Overdue'] += 1
-                user_workload[user]['overdue'] += 1
+    stats = project_stats(file_id)
+    user_workload = stats['workload']
+    progress_data = stats['progress']
+    status_data = {
+        'Completed': stats['completed'],
+        'In Progress': stats['in_progress'],
+        'Not Started': stats['not_started'],
+        'Overdue': stats['overdue'],
+    }
     
     # Display charts
     col1, col2 = st.columns(2)
     
     with col1:
         # Progress distribution
-        if progress_data:
-            fig_progress = px.histogram(
-                x=progress_data,
-                nbins=10,
+        if len(progress_data):
+            # Binned into 10 bars regardless of subtask count, so the SVG stays small
+            fig_progress = go.Figure(go.Histogram(x=progress_data, nbinsx=10))
+            fig_progress.update_layout(
                 title="Progress Distribution",
-                labels={'x': 'Progress (%)', 'y': 'Number of Subtasks'}
+                xaxis_title='Progress (%)',
+                yaxis_title='Number of Subtasks'
             )
             st.plotly_chart(fig_progress, use_container_width=True)
     
@@ -278,52 +317,26 @@ def show_file_analytics(problem_file):
         st.plotly_chart(fig_status, use_container_width=True)
     
     # User workload analysis
-    if user_workload:
+    if not user_workload.empty:
         st.subheader("👥 Team Workload Analysis")
         
-        workload_data = []
-        for user, data in user_workload.items():
-            completion_rate = (data['completed'] / data['total'] * 100) if data['total'] > 0 else 0
-            workload_data.append({
-                'User': user,
-                'Total Tasks': data['total'],
-                'Completed': data['completed'],
-                'Overdue': data['overdue'],
-                'Completion Rate': f"{completion_rate:.1f}%"
-            })
-        
-        df_workload = pd.DataFrame(workload_data)
-        st.dataframe(df_workload, use_container_width=True)
+        # Every grouped user has at least one task, so the rate is always defined
+        df_workload = user_workload.assign(
+            **{'Completion Rate': (user_workload['Completed'] / user_workload['Total Tasks'] * 100).map('{:.1f}%'.format)}
+        )
+        st.dataframe(df_workload, hide_index=True, use_container_width=True)
     
     # Comments activity analysis
     st.subheader("💬 Comments Activity")
     
-    comments_by_user = {}
-    for comment in st.session_state.data.get('comments', {}).values():
-        user = comment.get('user_name', comment.get('user', 'Unknown'))
-        if user not in comments_by_user:
-            comments_by_user[user] = {'total': 0, 'as_partner': 0, 'as_admin': 0, 'as_user': 0}
-        comments_by_user[user]['total'] += 1
-        role = comment.get('user_role', 'User')
-        if role == 'Partner':
-            comments_by_user[user]['as_partner'] += 1
-        elif role == 'Admin':
-            comments_by_user[user]['as_admin'] += 1
-        else:
-            comments_by_user[user]['as_user'] += 1
-    
-    if comments_by_user:
-        comments_data = []
-        for user, data in comments_by_user.items():
-            comments_data.append({
-                'User': user,
-                'Total Comments': data['total'],
-                'As Partner': data['as_partner'],
-                'As Admin': data['as_admin'],
-                'As User': data['as_user']
-            })
-        
-        df_comments = pd.DataFrame(comments_data)
-        st.dataframe(df_comments, use_container_width=True)
+    comments = st.session_state.data.get('comments', {})
+    if comments:
+        cdf = pd.DataFrame.from_records(list(comments.values()), columns=['user_name', 'user_role'])
+        # Anything other than Partner/Admin counts as a plain user comment
+        role_column = cdf['user_role'].map({'Partner': 'As Partner', 'Admin': 'As Admin'}).fillna('As User')
+        df_comments = pd.crosstab(cdf['user_name'].fillna('Unknown').rename('User'), role_column).reindex(
+            columns=['As Partner', 'As Admin', 'As User'], fill_value=0)
+        df_comments.insert(0, 'Total Comments', df_comments.sum(axis=1))
+        st.dataframe(df_comments.reset_index(), use_container_width=True)
     else:
         st.info("No comments activity yet.")
\ No newline at end of file
@@ -4,8 +4,9 @@ Configuration and session state management
 import streamlit as st
 
 # Load user credentials from TOML file
+@st.cache_resource
 def load_credentials():
-    """Load user credentials from Streamlit secrets"""
+    """Load user credentials from Streamlit secrets, once per process"""
     try:
         return st.secrets["credentials"]
     except Exception as e:
@@ -13,27 +14,39 @@ def load_credentials():
         return {}
 
 # Load user roles from TOML file
+@st.cache_resource
 def load_user_roles():
-    """Load user roles from Streamlit secrets"""
+    """Load user roles from Streamlit secrets, once per process"""
     try:
         return st.secrets.get("user_roles", {})
     except Exception as e:
         st.error(f"Error loading user roles from secrets: {e}")
         return {}
 
+@st.cache_resource
+def load_usernames() -> tuple:
+    """Usernames from the credentials, shared by every session"""
+    return tuple(load_credentials().keys())
+
 # Initialize session state
 def initialize_session_state():
     """Initialize all session state variables"""
     if 'data' not in st.session_state:
-        # Load credentials at initialization
-        USER_CREDENTIALS = load_credentials()
         st.session_state.data = {
             'problem_files': {},
-            'users': list(USER_CREDENTIALS.keys()),
+            'users': list(load_usernames()),
             'comments': {},  # Store comments
             'contacts': {}   # Store contacts
         }
 
+    if 'comment_counts' not in st.session_state:
+        # (entity_type, entity_id) -> number of comments, rebuilt by load_comments
+        st.session_state.comment_counts = {}
+
+    if 'contacts_by_file' not in st.session_state:
+        # problem_file_id -> {contact_id: contact}, rebuilt by load_contacts
+        st.session_state.contacts_by_file = {}
+
     if 'current_file_id' not in st.session_state:
         st.session_state.current_file_id = None
 
@@ -2,8 +2,11 @@
 Database operations module for Supabase integration
 """
 import streamlit as st
+import pandas as pd
+from collections import Counter
 from datetime import datetime, timedelta
 from supabase import create_client, Client
+from utils import is_privileged
 
 # Initialize Supabase client
 @st.cache_resource
@@ -13,15 +16,24 @@ def init_supabase():
     key = st.secrets["supabase"]["key"]
     return create_client(url, key)
 
-# Helper function to parse dates safely
-def safe_parse_date(date_str):
-    """Parse dates safely from database"""
-    if isinstance(date_str, str):
-        date_str = date_str.replace('Z', '+00:00')
-        if '+00:00' not in date_str and 'T' in date_str:
-            date_str += '+00:00'
-        return datetime.fromisoformat(date_str)
-    return date_str if isinstance(date_str, datetime) else datetime.now()
+def parse_dates_bulk(values: list) -> list:
+    """
+    Parse a whole column of database timestamps in one vectorized call
+    
+    Naive timestamps are taken as UTC; missing or unparseable values fall
+    back to now.
+    """
+    if not values:
+        return []
+    parsed = pd.to_datetime(values, utc=True, format='ISO8601', errors='coerce')
+    return parsed.fillna(pd.Timestamp.now(tz='UTC')).to_pydatetime().tolist()
+
+# Columns of st.session_state.data['subtasks_df'], one row per subtask
+SUBTASK_FRAME_COLUMNS = ['file_id', 'task_id', 'subtask_id', 'task_name', 'name',
+                         'assigned_to', 'start_date', 'projected_end_date', 'progress']
+
+# problem_files row with its tasks and their subtasks embedded (PostgREST resource embedding)
+_FILE_TREE_SELECT = '*, tasks(*, subtasks(*))'
 
 # Load data functions
 def load_data():
@@ -30,88 +42,11 @@ def load_data():
         return
         
     try:
-        supabase = init_supabase()
-        
-        # Load problem files with user filtering
-        if st.session_state.user_role in ['Admin', 'Partner']:
-            # Admin and Partners see all files
-            problem_files_response = supabase.table('problem_files').select('*').execute()
-        else:
-            # Regular users see files they own or are assigned to
-            owned_files = supabase.table('problem_files').select('*').eq('owner', st.session_state.current_user).execute()
-            
-            assigned_subtasks = supabase.table('subtasks').select('task_id').eq('assigned_to', st.session_state.current_user).execute()
-            
-            if assigned_subtasks.data:
-                task_ids = [subtask['task_id'] for subtask in assigned_subtasks.data]
-                assigned_tasks = supabase.table('tasks').select('problem_file_id').in_('id', task_ids).execute()
-                
-                if assigned_tasks.data:
-                    file_ids = [task['problem_file_id'] for task in assigned_tasks.data]
-                    assigned_files = supabase.table('problem_files').select('*').in_('id', file_ids).execute()
-                else:
-                    assigned_files = type('obj', (object,), {'data': []})
-            else:
-                assigned_files = type('obj', (object,), {'data': []})
-            
-            # Combine results
-            all_file_ids = set()
-            problem_files_data = []
-            
-            for pf in owned_files.data:
-                if pf['id'] not in all_file_ids:
-                    problem_files_data.append(pf)
-                    all_file_ids.add(pf['id'])
-                    
-            for pf in assigned_files.data:
-                if pf['id'] not in all_file_ids:
-                    problem_files_data.append(pf)
-                    all_file_ids.add(pf['id'])
-                    
-            problem_files_response = type('obj', (object,), {'data': problem_files_data})
-        
-        problem_files = {}
-        
-        for pf in problem_files_response.data:
-            file_id = pf['id']
-            
-            problem_files[file_id] = {
-                'problem_name': pf['problem_name'],
-                'owner': pf['owner'],
-                'project_start_date': safe_parse_date(pf['project_start_date']),
-                'project_end_date': safe_parse_date(pf.get('project_end_date', pf['project_start_date'])),
-                'display_week': pf['display_week'],
-                'created_date': safe_parse_date(pf['created_date']),
-                'last_modified': safe_parse_date(pf['last_modified']),
-                'tasks': {}
-            }
-            
-            # Load tasks for this problem file
-            tasks_response = supabase.table('tasks').select('*').eq('problem_file_id', file_id).execute()
-            
-            for task in tasks_response.data:
-                task_id = task['id']
-                problem_files[file_id]['tasks'][task_id] = {
-                    'name': task['name'],
-                    'description': task['description'] or '',
-                    'subtasks': {}
-                }
-                
-                # Load subtasks for this task
-                subtasks_response = supabase.table('subtasks').select('*').eq('task_id', task_id).execute()
-                
-                for subtask in subtasks_response.data:
-                    subtask_id = subtask['id']
-                    problem_files[file_id]['tasks'][task_id]['subtasks'][subtask_id] = {
-                        'name': subtask['name'],
-                        'assigned_to': subtask['assigned_to'],
-                        'start_date': safe_parse_date(subtask['start_date']),
-                        'projected_end_date': safe_parse_date(subtask['projected_end_date']),
-                        'progress': subtask['progress'],
-                        'notes': subtask['notes'] or ''
-                    }
-        
+        problem_files, subtasks_df, tree_index = _fetch_problem_files(
+            st.session_state.current_user, is_privileged())
         st.session_state.data['problem_files'] = problem_files
+        st.session_state.data['subtasks_df'] = subtasks_df
+        st.session_state.data['_index'] = tree_index
         
         # Load comments and contacts
         load_comments()
@@ -120,66 +55,219 @@ def load_data():
     except Exception as e:
         st.error(f"Error loading data from Supabase: {e}")
         st.session_state.data['problem_files'] = {}
+        st.session_state.data['subtasks_df'] = pd.DataFrame(columns=SUBTASK_FRAME_COLUMNS)
+        st.session_state.data['_index'] = build_tree_index({})
+
+def build_tree_index(problem_files: dict) -> dict:
+    """
+    Parent lookups for the problem file tree, stored as data['_index']
+    
+    Returns:
+        dict: 'task_parent' task_id -> file_id, 'subtask_parent'
+        subtask_id -> (file_id, task_id), 'subtasks_by_file' file_id -> [subtask_id]
+    """
+    task_parent = {}
+    subtask_parent = {}
+    subtasks_by_file = {}
+    for file_id, file_data in problem_files.items():
+        file_subtasks = subtasks_by_file[file_id] = []
+        for task_id, task in file_data['tasks'].items():
+            task_parent[task_id] = file_id
+            for subtask_id in task['subtasks']:
+                subtask_parent[subtask_id] = (file_id, task_id)
+                file_subtasks.append(subtask_id)
+    return {'task_parent': task_parent, 'subtask_parent': subtask_parent,
+            'subtasks_by_file': subtasks_by_file}
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _fetch_problem_files(current_user: str, privileged: bool) -> tuple:
+    """
+    Fetch the problem file tree visible to a user
+    
+    Returns the nested problem_files dict, a flat subtasks DataFrame built
+    from the same rows and the build_tree_index parent lookups. Cached per
+    (user, privileged) so reruns reuse one fetch; every save/delete of files,
+    tasks or subtasks clears it. Callers get their own copy and may mutate it
+    freely.
+    """
+    supabase = init_supabase()
+    
+    # Load problem files with user filtering; tasks and subtasks are embedded
+    # through their foreign keys so each file arrives as a complete tree
+    if privileged:
+        # Admin and Partners see all files
+        problem_files_data = supabase.table('problem_files').select(_FILE_TREE_SELECT).execute().data
+    else:
+        # Regular users see files they own or are assigned to
+        problem_files_data = supabase.table('problem_files').select(_FILE_TREE_SELECT).eq('owner', current_user).execute().data
+        
+        # Tasks with at least one subtask assigned to the user, resolved server-side
+        assigned_tasks = supabase.table('tasks').select(
+            'problem_file_id, subtasks!inner(assigned_to)'
+        ).eq('subtasks.assigned_to', current_user).execute()
+        
+        owned_ids = {pf['id'] for pf in problem_files_data}
+        assigned_ids = list({task['problem_file_id'] for task in assigned_tasks.data} - owned_ids)
+        if assigned_ids:
+            problem_files_data += supabase.table('problem_files').select(_FILE_TREE_SELECT).in_('id', assigned_ids).execute().data
+    
+    problem_files = {}
+    all_subtasks = []
+    
+    for pf in problem_files_data:
+        file_id = pf['id']
+        
+        # Dates are filled in below, one vectorized parse per column
+        problem_files[file_id] = {
+            'problem_name': pf['problem_name'],
+            'owner': pf['owner'],
+            'display_week': pf['display_week'],
+            'tasks': {}
+        }
+        
+        for task in pf.get('tasks') or []:
+            task_id = task['id']
+            problem_files[file_id]['tasks'][task_id] = {
+                'name': task['name'],
+                'description': task['description'] or '',
+                'subtasks': {}
+            }
+            
+            for subtask in task.get('subtasks') or []:
+                subtask_id = subtask['id']
+                problem_files[file_id]['tasks'][task_id]['subtasks'][subtask_id] = {
+                    'name': subtask['name'],
+                    'assigned_to': subtask['assigned_to'],
+                    'progress': subtask['progress'],
+                    'notes': subtask['notes'] or ''
+                }
+                all_subtasks.append((problem_files[file_id]['tasks'][task_id]['subtasks'][subtask_id], subtask,
+                                     file_id, task_id, task['name']))
+    
+    file_dates = zip(
+        parse_dates_bulk([pf['project_start_date'] for pf in problem_files_data]),
+        parse_dates_bulk([pf.get('project_end_date', pf['project_start_date']) for pf in problem_files_data]),
+        parse_dates_bulk([pf['created_date'] for pf in problem_files_data]),
+        parse_dates_bulk([pf['last_modified'] for pf in problem_files_data]),
+    )
+    for pf, (start, end, created, modified) in zip(problem_files_data, file_dates):
+        problem_files[pf['id']].update(project_start_date=start, project_end_date=end,
+                                       created_date=created, last_modified=modified)
+    
+    starts = parse_dates_bulk([item[1]['start_date'] for item in all_subtasks])
+    ends = parse_dates_bulk([item[1]['projected_end_date'] for item in all_subtasks])
+    for (subtask, *_), start, end in zip(all_subtasks, starts, ends):
+        subtask['start_date'] = start
+        subtask['projected_end_date'] = end
+    
+    # Columnar copy of every subtask for charts and aggregates
+    subtasks_df = pd.DataFrame({
+        'file_id': [item[2] for item in all_subtasks],
+        'task_id': [item[3] for item in all_subtasks],
+        'subtask_id': [item[1]['id'] for item in all_subtasks],
+        'task_name': [item[4] for item in all_subtasks],
+        'name': [item[0]['name'] for item in all_subtasks],
+        'assigned_to': [item[0]['assigned_to'] for item in all_subtasks],
+        'start_date': pd.to_datetime(starts, utc=True),
+        'projected_end_date': pd.to_datetime(ends, utc=True),
+        'progress': [item[0]['progress'] for item in all_subtasks],
+    }, columns=SUBTASK_FRAME_COLUMNS)
+    
+    return problem_files, subtasks_df, build_tree_index(problem_files)
 
 def load_comments():
     """Load comments from Supabase"""
     try:
-        supabase = init_supabase()
-        comments_response = supabase.table('comments').select('*').execute()
-        
-        comments = {}
-        for comment in comments_response.data:
-            comment_id = comment['id']
-            
-            # Parse created_at date safely
-            created_at = comment.get('created_at')
-            if created_at:
-                created_at = safe_parse_date(created_at)
-            else:
-                created_at = datetime.now()
-            
-            comments[comment_id] = {
-                'entity_type': comment.get('entity_type', ''),
-                'entity_id': comment.get('entity_id', ''),
-                'user_name': comment.get('user_name', ''),
-                'text': comment.get('text', ''),
-                'created_at': created_at,
-                'parent_id': comment.get('parent_id'),
-                'user_role': comment.get('user_role', 'User')
-            }
-        
+        comments, comment_counts = _fetch_comments()
         st.session_state.data['comments'] = comments
+        st.session_state.comment_counts = comment_counts
         
     except Exception as e:
         st.error(f"Error loading comments: {e}")
         st.session_state.data['comments'] = {}
+        st.session_state.comment_counts = Counter()
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _fetch_comments():
+    """Fetch all comments plus per-entity counts; cleared by comment saves/deletes"""
+    supabase = init_supabase()
+    comments_response = supabase.table('comments').select('*').execute()
+    
+    comments = {}
+    comment_counts = Counter()
+    rows = comments_response.data
+    created_dates = parse_dates_bulk([comment.get('created_at') for comment in rows])
+    for comment, created_at in zip(rows, created_dates):
+        comment_id = comment['id']
+        comments[comment_id] = {
+            'entity_type': comment.get('entity_type', ''),
+            'entity_id': comment.get('entity_id', ''),
+            'user_name': comment.get('user_name', ''),
+            'text': comment.get('text', ''),
+            'created_at': created_at,
+            'parent_id': comment.get('parent_id'),
+            'user_role': comment.get('user_role', 'User')
+        }
+        comment_counts[(comments[comment_id]['entity_type'], comments[comment_id]['entity_id'])] += 1
+    
+    return comments, comment_counts
 
 def load_contacts():
     """Load contacts from Supabase"""
     try:
-        supabase = init_supabase()
-        contacts_response = supabase.table('contacts').select('*').execute()
-        
-        contacts = {}
-        for contact in contacts_response.data:
-            contact_id = contact['id']
-            contacts[contact_id] = {
-                'problem_file_id': contact['problem_file_id'],
-                'name': contact['name'],
-                'organization': contact.get('organization', ''),
-                'title': contact.get('title', ''),
-                'email': contact.get('email', ''),
-                'telephone': contact.get('telephone', ''),
-                'comments': contact.get('comments', ''),
-                'added_by': contact.get('added_by', ''),
-                'created_at': safe_parse_date(contact['created_at'])
-            }
-        
+        contacts, contacts_by_file = _fetch_contacts()
         st.session_state.data['contacts'] = contacts
+        st.session_state.contacts_by_file = contacts_by_file
         
     except Exception as e:
         st.error(f"Error loading contacts: {e}")
         st.session_state.data['contacts'] = {}
+        st.session_state.contacts_by_file = {}
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _fetch_contacts():
+    """Fetch all contacts plus the per-file index; cleared by contact saves/deletes"""
+    supabase = init_supabase()
+    contacts_response = supabase.table('contacts').select('*').execute()
+    
+    contacts = {}
+    contacts_by_file = {}
+    rows = contacts_response.data
+    created_dates = parse_dates_bulk([contact.get('created_at') for contact in rows])
+    for contact, created_at in zip(rows, created_dates):
+        contact_id = contact['id']
+        contacts[contact_id] = {
+            'problem_file_id': contact['problem_file_id'],
+            'name': contact['name'],
+            'organization': contact.get('organization', ''),
+            'title': contact.get('title', ''),
+            'email': contact.get('email', ''),
+            'telephone': contact.get('telephone', ''),
+            'comments': contact.get('comments', ''),
+            'added_by': contact.get('added_by', ''),
+            'created_at': created_at
+        }
+        # Secondary index so per-file lookups don't scan every contact
+        contacts_by_file.setdefault(contact['problem_file_id'], {})[contact_id] = contacts[contact_id]
+    
+    return contacts, contacts_by_file
+
+@st.cache_data(ttl=30, show_spinner=False)
+def fetch_table_counts() -> dict:
+    """Row counts of every table in one RPC (migrations/003_problem_tracker_counts.sql)"""
+    supabase = init_supabase()
+    return supabase.rpc('problem_tracker_counts').execute().data
+
+def fetch_all_problem_files() -> tuple:
+    """Every problem file regardless of the session's role, for process-wide jobs such as the deadline sweep"""
+    return _fetch_problem_files(None, True)
+
+def clear_data_cache():
+    """Drop all cached table fetches so the next load_data reads fresh rows"""
+    _fetch_problem_files.clear()
+    _fetch_comments.clear()
+    _fetch_contacts.clear()
+    fetch_table_counts.clear()
 
 # Save functions
 def save_problem_file(file_id: str, file_data: dict):
@@ -199,6 +287,7 @@ def save_problem_file(file_id: str, file_data: dict):
         }
         
         supabase.table('problem_files').upsert(db_data).execute()
+        _fetch_problem_files.clear()
         return True
         
     except Exception as e:
@@ -218,54 +307,94 @@ def save_task(problem_file_id: str, task_id: str, task_data: dict):
         }
         
         supabase.table('tasks').upsert(db_data).execute()
+        _fetch_problem_files.clear()
         return True
         
     except Exception as e:
         st.error(f"Error saving task: {e}")
         return False
 
+def _subtask_row(task_id: str, subtask_id: str, subtask_data: dict) -> dict:
+    """Map an in-memory subtask to its subtasks table row"""
+    return {
+        'id': subtask_id,
+        'task_id': task_id,
+        'name': subtask_data['name'],
+        'assigned_to': subtask_data['assigned_to'],
+        'start_date': subtask_data['start_date'].isoformat(),
+        'projected_end_date': subtask_data['projected_end_date'].isoformat(),
+        'progress': subtask_data['progress'],
+        'notes': subtask_data.get('notes', '')
+    }
+
 def save_subtask(task_id: str, subtask_id: str, subtask_data: dict):
     """Save or update a subtask"""
     try:
         supabase = init_supabase()
-        
-        db_data = {
-            'id': subtask_id,
-            'task_id': task_id,
-            'name': subtask_data['name'],
-            'assigned_to': subtask_data['assigned_to'],
-            'start_date': subtask_data['start_date'].isoformat(),
-            'projected_end_date': subtask_data['projected_end_date'].isoformat(),
-            'progress': subtask_data['progress'],
-            'notes': subtask_data.get('notes', '')
-        }
-        
-        supabase.table('subtasks').upsert(db_data).execute()
+        supabase.table('subtasks').upsert(_subtask_row(task_id, subtask_id, subtask_data)).execute()
+        _fetch_problem_files.clear()
         return True
         
     except Exception as e:
         st.error(f"Error saving subtask: {e}")
         return False
 
-def save_comment(comment_id: str, comment_data: dict):
-    """Save a comment to Supabase"""
+def save_subtasks(task_id: str, subtasks: dict):
+    """Save or update several subtasks of one task in a single upsert"""
+    return save_subtasks_bulk((task_id, subtask_id, data) for subtask_id, data in subtasks.items())
+
+# Rows per upsert request; keeps request bodies bounded for very large batches
+_BULK_CHUNK_SIZE = 1000
+
+def save_subtasks_bulk(items):
+    """Save or update (task_id, subtask_id, subtask_data) items, one upsert per chunk of rows"""
+    rows = [_subtask_row(task_id, subtask_id, data) for task_id, subtask_id, data in items]
+    if not rows:
+        return True
     try:
         supabase = init_supabase()
-        
-        # Prepare the data matching your schema
-        db_data = {
-            'id': comment_id,
-            'entity_type': comment_data.get('entity_type', ''),
-            'entity_id': comment_data.get('entity_id', ''),
-            'user_name': comment_data.get('user_name', ''),
-            'text': comment_data.get('text', ''),
-            'parent_id': comment_data.get('parent_id'),
-            'user_role': comment_data.get('user_role', 'User')
-        }
-        
-        supabase.table('comments').upsert(db_data).execute()
+        for i in range(0, len(rows), _BULK_CHUNK_SIZE):
+            supabase.table('subtasks').upsert(rows[i:i + _BULK_CHUNK_SIZE]).execute()
+        _fetch_problem_files.clear()
         return True
         
+    except Exception as e:
+        # Earlier chunks may have landed; drop the cache so the next load shows them
+        _fetch_problem_files.clear()
+        st.error(f"Error saving subtasks: {e}")
+        return False
+
+def save_comment(comment_id, comment_data: dict):
+    """
+    Save a comment to Supabase
+
+    Pass comment_id=None for new comments so the database assigns the id
+    (comments.id defaults to gen_random_uuid()). Returns the comment id on
+    success, False on failure.
+    """
+    # Prepare the data matching your schema
+    db_data = {
+        'entity_type': comment_data.get('entity_type', ''),
+        'entity_id': comment_data.get('entity_id', ''),
+        'user_name': comment_data.get('user_name', ''),
+        'text': comment_data.get('text', ''),
+        'parent_id': comment_data.get('parent_id'),
+        'user_role': comment_data.get('user_role', 'User')
+    }
+
+    try:
+        supabase = init_supabase()
+
+        if comment_id:
+            db_data['id'] = comment_id
+            supabase.table('comments').upsert(db_data).execute()
+            _fetch_comments.clear()
+            return comment_id
+
+        response = supabase.table('comments').insert(db_data).execute()
+        _fetch_comments.clear()
+        return response.data[0]['id']
+
     except Exception as e:
         st.error(f"Error saving comment: {e}")
         st.error(f"Debug - Comment data: {db_data}")
@@ -290,6 +419,7 @@ def save_contact(contact_id: str, contact_data: dict):
         }
         
         supabase.table('contacts').upsert(db_data).execute()
+        _fetch_contacts.clear()
         return True
         
     except Exception as e:
@@ -302,6 +432,8 @@ def delete_problem_file(file_id: str):
     try:
         supabase = init_supabase()
         supabase.table('problem_files').delete().eq('id', file_id).execute()
+        # Cascades to tasks, subtasks and contacts
+        clear_data_cache()
         return True
     except Exception as e:
         st.error(f"Error deleting problem file: {e}")
@@ -312,6 +444,7 @@ def delete_task(task_id: str):
     try:
         supabase = init_supabase()
         supabase.table('tasks').delete().eq('id', task_id).execute()
+        _fetch_problem_files.clear()
         return True
     except Exception as e:
         st.error(f"Error deleting task: {e}")
@@ -322,6 +455,7 @@ def delete_subtask(subtask_id: str):
     try:
         supabase = init_supabase()
         supabase.table('subtasks').delete().eq('id', subtask_id).execute()
+        _fetch_problem_files.clear()
         return True
     except Exception as e:
         st.error(f"Error deleting subtask: {e}")
@@ -332,6 +466,7 @@ def delete_comment(comment_id: str):
     try:
         supabase = init_supabase()
         supabase.table('comments').delete().eq('id', comment_id).execute()
+        _fetch_comments.clear()
         return True
     except Exception as e:
         st.error(f"Error deleting comment: {e}")
@@ -342,6 +477,7 @@ def delete_contact(contact_id: str):
     try:
         supabase = init_supabase()
         supabase.table('contacts').delete().eq('id', contact_id).execute()
+        _fetch_contacts.clear()
         return True
     except Exception as e:
         st.error(f"Error deleting contact: {e}")
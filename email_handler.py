@@ -2,81 +2,189 @@
 Email handler module for SendGrid integration
 """
 import streamlit as st
+import pandas as pd
 from sendgrid import SendGridAPIClient
 from sendgrid.helpers.mail import Mail
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from html import escape
+from string import Template
 import logging
+from database import fetch_all_problem_files
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Notification bodies, parsed once; user-supplied fields are escaped before substitution
+_COMMENT_EMAIL_TMPL = Template("""
+    <html>
+        <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
+            <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
+                <h2 style="color: #2f74c0;">New Partner Comment</h2>
+                
+                <p>Hi $file_owner,</p>
+                
+                <p><strong>$partner_name</strong> has commented on your problem file:</p>
+                
+                <div style="background: #f5f5f5; padding: 15px; border-left: 4px solid #2f74c0; margin: 20px 0;">
+                    <p><strong>Problem File:</strong> $file_name</p>
+                    <p><strong>Task/Subtask:</strong> $task_name</p>
+                    <p><strong>Comment:</strong></p>
+                    <p style="font-style: italic;">"$comment_text"</p>
+                </div>
+                
+                <p>Log in to the Problem File Tracker to view and respond to this comment.</p>
+                
+                <hr style="border: none; border-top: 1px solid #ddd; margin: 30px 0;">
+                <p style="font-size: 12px; color: #666;">
+                    This is an automated notification from Problem File Tracker.
+                </p>
+            </div>
+        </body>
+    </html>
+    """)
+
+_DEADLINE_EMAIL_TMPL = Template("""
+    <html>
+        <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
+            <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
+                <h2 style="color: #ff9900;">⚠️ Upcoming Deadlines</h2>
+                
+                <p>Hi $file_owner,</p>
+                
+                <p>The following tasks in <strong>'$file_name'</strong> have deadlines approaching:</p>
+                
+                <div style="background: #fff9e6; padding: 15px; border: 1px solid #ffcc00; margin: 20px 0;">
+                    $tasks_html
+                </div>
+                
+                <p>Please log in to the Problem File Tracker to review and update these tasks.</p>
+                
+                <hr style="border: none; border-top: 1px solid #ddd; margin: 30px 0;">
+                <p style="font-size: 12px; color: #666;">
+                    This is an automated deadline reminder from Problem File Tracker.
+                </p>
+            </div>
+        </body>
+    </html>
+    """)
+
+_DEADLINE_ROW_TMPL = Template("""
+        <div style="background: #fff; border: 1px solid #ddd; padding: 10px; margin: 10px 0; border-radius: 5px;">
+            <p><strong>$task_name</strong></p>
+            <p>Assigned to: $assigned_to</p>
+            <p>Due: $due_date (<span style="color: $status_color;">$days_until days remaining</span>)</p>
+            <p>Progress: $progress%</p>
+        </div>
+        """)
+
+# Row templates with the urgency color already filled in: red for a day or less, amber otherwise
+_DEADLINE_ROW_RED = Template(_DEADLINE_ROW_TMPL.safe_substitute(status_color="#ff0000"))
+_DEADLINE_ROW_AMBER = Template(_DEADLINE_ROW_TMPL.safe_substitute(status_color="#ff9900"))
+
+@st.cache_resource
+def mail_pool():
+    """Shared, bounded worker pool for sending notifications off the request path"""
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="sg-mail")
+
+@st.cache_resource
 def get_sendgrid_client():
-    """Initialize SendGrid client"""
+    """Initialize the SendGrid client once per process; cleared if the API key is rejected"""
     try:
         api_key = st.secrets.get("sendgrid", {}).get("api_key")
         if api_key:
             return SendGridAPIClient(api_key)
         return None
     except Exception as e:
-        logger.error(f"Failed to initialize SendGrid: {e}")
+        logger.error("Failed to initialize SendGrid: %s", e)
         return None
 
+@st.cache_resource
+def _from_email():
+    """Sender address from secrets, read once per process"""
+    return st.secrets.get("sendgrid", {}).get("from_email", "noreply@problemtracker.com")
+
+def _handle_send_error(e):
+    """Drop the cached client when SendGrid rejects the key, so the next send rebuilds it"""
+    if getattr(e, 'status_code', None) == 401:
+        get_sendgrid_client.clear()
+
+@st.cache_resource
+def _user_emails():
+    """Read the user_emails secrets mapping once per process"""
+    return dict(st.secrets.get("user_emails", {}))
+
+@st.cache_resource
+def _user_emails_lower():
+    """user_emails keyed by lowercased username, for case-insensitive O(1) lookups"""
+    return {key.lower(): value for key, value in _user_emails().items()}
+
+@st.cache_data(ttl=300, show_spinner=False)
 def get_user_email(username):
-    """Get user email from secrets - handles case sensitivity and whitespace"""
+    """Get user email from secrets - handles case sensitivity and whitespace
+    
+    Exact and case-insensitive matches are single dict lookups; the partial
+    match scan only runs on a miss, and results are cached per username.
+    """
     try:
         if not username:
-            print(f"[EMAIL] No username provided")
+            logger.debug("[EMAIL] No username provided")
             return None
-            
-        user_emails = st.secrets.get("user_emails", {})
         
         # Clean the username (remove whitespace)
         username_clean = username.strip()
         
-        print(f"[EMAIL] Looking for email for: '{username}' (cleaned: '{username_clean}')")
-        print(f"[EMAIL] Available users: {list(user_emails.keys())}")
-        
         # Try exact match first
-        if username_clean in user_emails:
-            email = user_emails[username_clean]
-            print(f"[EMAIL] Found exact match: {email}")
+        email = _user_emails().get(username_clean)
+        if email:
+            logger.debug("[EMAIL] Found exact match for '%s'", username_clean)
             return email
         
         # Try case-insensitive match
-        for key, value in user_emails.items():
-            if key.lower() == username_clean.lower():
-                print(f"[EMAIL] Found case-insensitive match: {key} -> {value}")
-                return value
+        username_lower = username_clean.lower()
+        user_emails_lower = _user_emails_lower()
+        email = user_emails_lower.get(username_lower)
+        if email:
+            logger.debug("[EMAIL] Found case-insensitive match for '%s'", username_clean)
+            return email
         
         # Try partial match (in case there's extra text)
-        for key, value in user_emails.items():
-            if key.lower() in username_clean.lower() or username_clean.lower() in key.lower():
-                print(f"[EMAIL] Found partial match: {key} -> {value}")
+        for key, value in user_emails_lower.items():
+            if key in username_lower or username_lower in key:
+                logger.debug("[EMAIL] Found partial match: %s -> %s", key, value)
                 return value
         
-        print(f"[EMAIL] No email found for: '{username}'")
-        print(f"[EMAIL] Available keys: {list(user_emails.keys())}")
+        logger.debug("[EMAIL] No email found for: '%s'", username)
         return None
         
     except Exception as e:
-        print(f"[EMAIL ERROR] Exception in get_user_email: {e}")
+        logger.error("[EMAIL ERROR] Exception in get_user_email: %s", e)
         return None
 
+def get_user_emails_bulk(usernames):
+    """Resolve emails for several users in one pass; users without an email are omitted"""
+    emails = {}
+    for username in usernames:
+        email = get_user_email(username)
+        if email:
+            emails[username] = email
+    return emails
+
 def send_email_async(to_email, subject, html_content):
     """Send email asynchronously to avoid blocking UI"""
     def send():
         try:
-            print(f"[SENDGRID] Starting email send to: {to_email}")
+            logger.debug("[SENDGRID] Starting email send to: %s", to_email)
             
             sg = get_sendgrid_client()
             if not sg:
-                print("[SENDGRID ERROR] SendGrid client not available - check API key")
+                logger.error("[SENDGRID ERROR] SendGrid client not available - check API key")
                 return
             
-            from_email = st.secrets.get("sendgrid", {}).get("from_email", "noreply@problemtracker.com")
-            print(f"[SENDGRID] From: {from_email}, To: {to_email}")
+            from_email = _from_email()
+            logger.debug("[SENDGRID] From: %s, To: %s", from_email, to_email)
             
             message = Mail(
                 from_email=from_email,
@@ -85,154 +193,193 @@ def send_email_async(to_email, subject, html_content):
                 html_content=html_content
             )
             
-            print(f"[SENDGRID] Sending email with subject: {subject}")
+            logger.debug("[SENDGRID] Sending email with subject: %s", subject)
             response = sg.send(message)
-            print(f"[SENDGRID SUCCESS] Email sent! Status code: {response.status_code}")
-            print(f"[SENDGRID SUCCESS] Response headers: {response.headers}")
+            logger.debug("[SENDGRID SUCCESS] Email sent! Status code: %s", response.status_code)
+            logger.debug("[SENDGRID SUCCESS] Response headers: %s", response.headers)
             
         except Exception as e:
-            print(f"[SENDGRID ERROR] Failed to send email: {str(e)}")
-            print(f"[SENDGRID ERROR] Exception type: {type(e).__name__}")
-            import traceback
-            print(f"[SENDGRID ERROR] Traceback: {traceback.format_exc()}")
+            logger.exception("[SENDGRID ERROR] Failed to send email (%s): %s", type(e).__name__, e)
+            _handle_send_error(e)
     
-    # Run in separate thread
-    print(f"[SENDGRID] Starting thread for email to {to_email}")
-    thread = threading.Thread(target=send)
-    thread.daemon = True
-    thread.start()
+    # Run on the shared pool rather than a fresh thread per email
+    logger.debug("[SENDGRID] Queueing email to %s", to_email)
+    mail_pool().submit(send)
+
+def send_emails_batch(messages):
+    """
+    Send several emails with one SendGrid client, synchronously
+
+    Args:
+        messages: list of (to_email, subject, html_content) tuples
+
+    Meant to be run on a background worker; one failed message does not stop the rest.
+    """
+    if not messages:
+        return
+
+    sg = get_sendgrid_client()
+    if not sg:
+        logger.error("[SENDGRID ERROR] SendGrid client not available - check API key")
+        return
+
+    from_email = _from_email()
+
+    for to_email, subject, html_content in messages:
+        try:
+            message = Mail(
+                from_email=from_email,
+                to_emails=to_email,
+                subject=subject,
+                html_content=html_content
+            )
+            response = sg.send(message)
+            logger.debug("[SENDGRID SUCCESS] Email to %s sent! Status code: %s", to_email, response.status_code)
+        except Exception as e:
+            logger.error("[SENDGRID ERROR] Failed to send email to %s: %s", to_email, e)
+            _handle_send_error(e)
 
-def send_partner_comment_notification(file_owner, partner_name, file_name, task_name, comment_text):
+def send_partner_comment_notification(file_owner, partner_name, file_name, task_name, comment_text,
+                                      owner_email=None):
     """Send email notification when partner comments"""
-    print(f"Attempting to send email for file_owner: {file_owner}")
+    logger.debug("Attempting to send email for file_owner: %s", file_owner)
 
-    owner_email = get_user_email(file_owner)
-    print(f"Found email for {file_owner}: {owner_email}")
+    if owner_email is None:
+        owner_email = get_user_email(file_owner)
+    logger.debug("Found email for %s: %s", file_owner, owner_email)
 
     if not owner_email:
-        print(f"No email configured for user {file_owner}")
+        logger.debug("No email configured for user %s", file_owner)
         return
     
     subject = f"New Comment on '{file_name}'"
     
-    html_content = f"""
-    <html>
-        <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-            <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
-                <h2 style="color: #2f74c0;">New Partner Comment</h2>
-                
-                <p>Hi {file_owner},</p>
-                
-                <p><strong>{partner_name}</strong> has commented on your problem file:</p>
-                
-                <div style="background: #f5f5f5; padding: 15px; border-left: 4px solid #2f74c0; margin: 20px 0;">
-                    <p><strong>Problem File:</strong> {file_name}</p>
-                    <p><strong>Task/Subtask:</strong> {task_name}</p>
-                    <p><strong>Comment:</strong></p>
-                    <p style="font-style: italic;">"{comment_text}"</p>
-                </div>
-                
-                <p>Log in to the Problem File Tracker to view and respond to this comment.</p>
-                
-                <hr style="border: none; border-top: 1px solid #ddd; margin: 30px 0;">
-                <p style="font-size: 12px; color: #666;">
-                    This is an automated notification from Problem File Tracker.
-                </p>
-            </div>
-        </body>
-    </html>
-    """
+    html_content = _COMMENT_EMAIL_TMPL.substitute(
+        file_owner=escape(file_owner),
+        partner_name=escape(partner_name),
+        file_name=escape(file_name),
+        task_name=escape(task_name),
+        comment_text=escape(comment_text)
+    )
     
     send_email_async(owner_email, subject, html_content)
 
-def send_deadline_notification(file_owner, file_name, task_details):
-    """Send email notification for approaching deadlines"""
-    owner_email = get_user_email(file_owner)
-    if not owner_email:
-        logger.info(f"No email configured for user {file_owner}")
-        return
-    
+def build_deadline_email(file_owner, file_name, task_details):
+    """Build the (subject, html_content) of an approaching-deadlines reminder"""
     subject = f"Upcoming Deadlines in '{file_name}'"
     
     # Build task list HTML
-    tasks_html = ""
-    for task in task_details:
-        days_until = task['days_until']
-        status_color = "#ff0000" if days_until <= 1 else "#ff9900"
-        
-        tasks_html += f"""
-        <div style="background: #fff; border: 1px solid #ddd; padding: 10px; margin: 10px 0; border-radius: 5px;">
-            <p><strong>{task['task_name']}</strong></p>
-            <p>Assigned to: {task['assigned_to']}</p>
-            <p>Due: {task['due_date']} (<span style="color: {status_color};">{days_until} days remaining</span>)</p>
-            <p>Progress: {task['progress']}%</p>
-        </div>
-        """
+    tasks_html = "".join(
+        (_DEADLINE_ROW_RED if task['days_until'] <= 1 else _DEADLINE_ROW_AMBER).substitute(
+            task_name=escape(task['task_name']),
+            assigned_to=escape(task['assigned_to']),
+            due_date=task['due_date'],
+            days_until=task['days_until'],
+            progress=task['progress']
+        )
+        for task in task_details
+    )
     
-    html_content = f"""
-    <html>
-        <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-            <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
-                <h2 style="color: #ff9900;">⚠️ Upcoming Deadlines</h2>
-                
-                <p>Hi {file_owner},</p>
-                
-                <p>The following tasks in <strong>'{file_name}'</strong> have deadlines approaching:</p>
-                
-                <div style="background: #fff9e6; padding: 15px; border: 1px solid #ffcc00; margin: 20px 0;">
-                    {tasks_html}
-                </div>
-                
-                <p>Please log in to the Problem File Tracker to review and update these tasks.</p>
-                
-                <hr style="border: none; border-top: 1px solid #ddd; margin: 30px 0;">
-                <p style="font-size: 12px; color: #666;">
-                    This is an automated deadline reminder from Problem File Tracker.
-                </p>
-            </div>
-        </body>
-    </html>
+    html_content = _DEADLINE_EMAIL_TMPL.substitute(
+        file_owner=escape(file_owner),
+        file_name=escape(file_name),
+        tasks_html=tasks_html
+    )
+    
+    return subject, html_content
+
+@st.cache_resource
+def _sweep_guard():
+    """Process-wide lock, last sweep date and in-progress flag, so concurrent sessions send reminders once a day"""
+    return {'lock': threading.Lock(), 'last_run': None, 'running': False}
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _compute_pending_alerts(subtasks, today):
     """
+    Find incomplete subtasks due within the alert window, grouped by file
     
-    send_email_async(owner_email, subject, html_content)
+    Pure function of the subtask columns and the date, so sessions seeing
+    the same subtasks on the same day reuse one traversal.
+    
+    Returns:
+        dict: file_id -> list of deadline dicts for build_deadline_email
+    """
+    alert_threshold = timedelta(days=3)  # Alert when 3 days or less remaining
+    if subtasks.empty:
+        return {}
+    
+    # One vectorized pass: days remaining per subtask, then keep incomplete ones inside the window
+    due_dates = subtasks['projected_end_date'].dt.normalize().dt.tz_localize(None)
+    days_until = (due_dates - pd.Timestamp(today)).dt.days
+    mask = (subtasks['progress'] < 100) & days_until.between(0, alert_threshold.days)
+    if not mask.any():
+        return {}
+    
+    # Only the matching rows get their labels and dates formatted
+    rows = subtasks[mask]
+    due_soon = rows.assign(
+        task_name=rows['task_name'] + ' - ' + rows['name'],
+        due_date=due_dates[mask].dt.strftime('%Y-%m-%d'),
+        days_until=days_until[mask]
+    )
+    columns = ['task_name', 'assigned_to', 'due_date', 'days_until', 'progress']
+    pending = {
+        file_id: group[columns].to_dict('records')
+        for file_id, group in due_soon.groupby('file_id', sort=False)
+    }
+    
+    return pending
 
 def check_and_send_deadline_alerts():
     """Check all problem files for approaching deadlines and send notifications"""
-    try:
-        if 'data' not in st.session_state or 'problem_files' not in st.session_state.data:
+    # Claim today's sweep; skip if another session already swept or is sweeping
+    today = datetime.now().date()
+    guard = _sweep_guard()
+    with guard['lock']:
+        if guard['running'] or guard['last_run'] == today:
             return
+        guard['running'] = True
+    
+    try:
+        # Every file, not the session's access-filtered view, so reminders don't depend on who logs in
+        problem_files, subtasks_df, _ = fetch_all_problem_files()
+        subtasks = subtasks_df[['file_id', 'task_name', 'name', 'assigned_to', 'projected_end_date', 'progress']]
+        pending = _compute_pending_alerts(subtasks, today)
         
-        today = datetime.now().date()
-        alert_threshold = timedelta(days=3)  # Alert when 3 days or less remaining
-        
-        for file_id, file_data in st.session_state.data['problem_files'].items():
-            approaching_deadlines = []
-            
-            for task_id, task in file_data.get('tasks', {}).items():
-                for subtask_id, subtask in task.get('subtasks', {}).items():
-                    if subtask['progress'] < 100:  # Only check incomplete tasks
-                        due_date = subtask['projected_end_date'].date()
-                        days_until = (due_date - today).days
-                        
-                        if 0 <= days_until <= alert_threshold.days:
-                            approaching_deadlines.append({
-                                'task_name': f"{task['name']} - {subtask['name']}",
-                                'assigned_to': subtask['assigned_to'],
-                                'due_date': due_date.strftime('%Y-%m-%d'),
-                                'days_until': days_until,
-                                'progress': subtask['progress']
-                            })
+        messages = []
+        for file_id, approaching_deadlines in pending.items():
+            file_data = problem_files.get(file_id)
+            if file_data is None:
+                continue
             
-            # Send notification if there are approaching deadlines
-            if approaching_deadlines:
-                send_deadline_notification(
-                    file_data['owner'],
-                    file_data['problem_name'],
-                    approaching_deadlines
-                )
+            # Queue a reminder for the file owner
+            owner_email = get_user_email(file_data['owner'])
+            if not owner_email:
+                logger.info("No email configured for user %s", file_data['owner'])
+                continue
+            subject, html_content = build_deadline_email(
+                file_data['owner'],
+                file_data['problem_name'],
+                approaching_deadlines
+            )
+            messages.append((owner_email, subject, html_content))
+        
+        # One background job sends the whole sweep with a single SendGrid client
+        if messages:
+            if not get_sendgrid_client():
+                logger.error("[SENDGRID ERROR] SendGrid client not available - deadline sweep will retry")
+                return
+            mail_pool().submit(send_emails_batch, messages)
+            logger.debug("Queued %s deadline reminder(s)", len(messages))
+        
+        # Only a sweep that got this far counts for today
+        guard['last_run'] = today
                 
     except Exception as e:
-        logger.error(f"Error checking deadlines: {e}")
+        logger.error("Error checking deadlines: %s", e)
+    finally:
+        with guard['lock']:
+            guard['running'] = False
 
 def is_email_configured():
     """Check if email is properly configured"""
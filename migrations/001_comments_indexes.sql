@@ -0,0 +1,8 @@
+-- Indexes backing the comment thread queries in components/comments.py
+-- get_entity_comments_from_db filters on (entity_type, entity_id) and orders by created_at
+CREATE INDEX IF NOT EXISTS comments_entity_created_idx
+    ON comments (entity_type, entity_id, created_at);
+
+-- Reply lookups group by parent_id
+CREATE INDEX IF NOT EXISTS comments_parent_id_idx
+    ON comments (parent_id);
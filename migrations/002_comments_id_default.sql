@@ -0,0 +1,6 @@
+-- Let Postgres generate comment ids; save_comment(None, ...) inserts without an id
+-- and reads the generated value back from the insert response
+CREATE EXTENSION IF NOT EXISTS pgcrypto;
+
+ALTER TABLE comments
+    ALTER COLUMN id SET DEFAULT gen_random_uuid();
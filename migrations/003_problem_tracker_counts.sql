@@ -0,0 +1,15 @@
+-- Row counts for the Data Management stats panel in one round trip
+-- Called as supabase.rpc('problem_tracker_counts') by database.fetch_table_counts
+CREATE OR REPLACE FUNCTION problem_tracker_counts()
+RETURNS json
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT json_build_object(
+        'files', (SELECT COUNT(*) FROM problem_files),
+        'tasks', (SELECT COUNT(*) FROM tasks),
+        'subtasks', (SELECT COUNT(*) FROM subtasks),
+        'comments', (SELECT COUNT(*) FROM comments),
+        'contacts', (SELECT COUNT(*) FROM contacts)
+    );
+$$;
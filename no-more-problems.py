@@ -53,7 +53,8 @@ def main():
     if st.session_state.authenticated:
         load_data()
         
-        # Check for approaching deadlines once per session
+        # Check for approaching deadlines once per session; the sweep itself runs
+        # at most once a day per process and covers every file whatever the role
         if 'deadline_check_done' not in st.session_state:
             check_and_send_deadline_alerts()
             st.session_state.deadline_check_done = True
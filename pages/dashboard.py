@@ -1,10 +1,13 @@
 """
 Dashboard page module
 """
+import heapq
 import streamlit as st
 import pandas as pd
+from operator import itemgetter
 from datetime import datetime
-from utils import get_accessible_files, calculate_project_progress
+from utils import (get_accessible_files, calculate_project_progress, is_privileged,
+                   count_file_comments, count_file_contacts)
 
 def show_dashboard():
     """Display main dashboard"""
@@ -20,39 +23,42 @@ def show_dashboard():
     else:
         st.subheader("Available Problem Files")
         
-        # Display problem files in a grid
-        cols = st.columns(3)
-        for i, (file_id, file_data) in enumerate(accessible_files.items()):
-            with cols[i % 3]:
-                progress = calculate_project_progress(file_data['tasks'])
-                
-                # Show ownership indicator
-                ownership_indicator = "👑 Owner" if file_data['owner'] == st.session_state.current_user else f"👤 Owner: {file_data['owner']}"
-                
-                # Count comments and contacts for this file
-                comments_count = 0
-                for task in file_data['tasks'].values():
-                    comments_count += len([c for c in st.session_state.data.get('comments', {}).values() 
-                                         if c['entity_type'] == 'task' and c['entity_id'] in file_data['tasks']])
-                    for subtask_id in task['subtasks']:
-                        comments_count += len([c for c in st.session_state.data.get('comments', {}).values() 
-                                             if c['entity_type'] == 'subtask' and c['entity_id'] == subtask_id])
-                
-                contacts_count = len([c for c in st.session_state.data.get('contacts', {}).values() 
-                                    if c['problem_file_id'] == file_id])
-                
-                st.metric(
-                    label=file_data['problem_name'],
-                    value=f"{progress:.1f}%",
-                    delta=f"💬 {comments_count} | 📇 {contacts_count}"
-                )
-                
-                st.caption(ownership_indicator)
-                
-                if st.button(f"Open {file_data['problem_name']}", key=f"open_{file_id}"):
-                    st.session_state.selected_file_for_view = file_id
-                    st.session_state.page = f"📁 {file_data['problem_name']}"
-                    st.rerun()
+        # All files in one grid; selecting a row opens that file
+        current_user = st.session_state.current_user
+        files_df = pd.DataFrame(
+            [
+                {
+                    'Problem File': file_data['problem_name'],
+                    'Progress': calculate_project_progress(file_data['tasks']),
+                    'Comments': count_file_comments(file_data),
+                    'Contacts': count_file_contacts(file_id),
+                    'Owner': "👑 Owner" if file_data['owner'] == current_user else f"👤 {file_data['owner']}"
+                }
+                for file_id, file_data in accessible_files.items()
+            ],
+            index=list(accessible_files)
+        )
+        
+        event = st.dataframe(
+            files_df,
+            column_config={
+                'Progress': st.column_config.ProgressColumn("Progress", format="%.1f%%",
+                                                            min_value=0, max_value=100),
+                'Comments': st.column_config.NumberColumn("💬 Comments"),
+                'Contacts': st.column_config.NumberColumn("📇 Contacts"),
+            },
+            hide_index=True,
+            use_container_width=True,
+            on_select="rerun",
+            selection_mode="single-row"
+        )
+        st.caption("Select a row to open the problem file.")
+        
+        if event.selection.rows:
+            file_id = files_df.index[event.selection.rows[0]]
+            st.session_state.selected_file_for_view = file_id
+            st.session_state.page = f"📁 {accessible_files[file_id]['problem_name']}"
+            st.rerun()
         
         # Quick actions
         st.subheader("Quick Actions")
@@ -82,14 +88,17 @@ def show_recent_activity(accessible_files):
     with tabs[0]:
         # Recent Notes
         all_notes = []
+        today = datetime.now().date()
+        current_user = st.session_state.current_user
+        privileged = is_privileged()
         for file_id, file_data in accessible_files.items():
             for task_id, task in file_data['tasks'].items():
                 for subtask_id, subtask in task['subtasks'].items():
                     if subtask.get('notes', '').strip():
                         # Only show notes for tasks assigned to user or if user is admin/partner/owner
-                        if (st.session_state.user_role in ['Admin', 'Partner'] or 
-                            file_data['owner'] == st.session_state.current_user or 
-                            subtask['assigned_to'] == st.session_state.current_user):
+                        if (privileged or 
+                            file_data['owner'] == current_user or 
+                            subtask['assigned_to'] == current_user):
                             all_notes.append({
                                 'Project': file_data['problem_name'],
                                 'Task': f"{task['name']} - {subtask['name']}",
@@ -97,7 +106,7 @@ def show_recent_activity(accessible_files):
                                 'Progress': f"{subtask['progress']}%",
                                 'Notes': subtask['notes'],
                                 'Due Date': subtask['projected_end_date'].strftime('%Y-%m-%d'),
-                                'Status': '🔴 Overdue' if (subtask['projected_end_date'].date() < datetime.now().date() and subtask['progress'] < 100) else '🟢 On Track'
+                                'Status': '🔴 Overdue' if (subtask['projected_end_date'].date() < today and subtask['progress'] < 100) else '🟢 On Track'
                             })
         
         if all_notes:
@@ -108,35 +117,42 @@ def show_recent_activity(accessible_files):
     
     with tabs[1]:
         # Recent Comments
+        # Resolve each comment's file and task through the parent index loaded with the data
+        tree_index = st.session_state.data['_index']
+        task_parent = tree_index['task_parent']
+        subtask_parent = tree_index['subtask_parent']
+        
         recent_comments = []
-        for comment_id, comment in st.session_state.data.get('comments', {}).items():
-            # Check if comment belongs to an accessible file
-            for file_id, file_data in accessible_files.items():
-                if comment['entity_type'] == 'task' and comment['entity_id'] in file_data['tasks']:
-                    recent_comments.append({
-                        'Project': file_data['problem_name'],
-                        'Task': file_data['tasks'][comment['entity_id']]['name'],
-                        'User_Name': comment['user_name'],
-                        'Role': comment.get('user_role', 'User'),
-                        'Comment': comment['text'][:100] + '...' if len(comment['text']) > 100 else comment['text'],
-                        'Posted': comment['created_at'].strftime('%Y-%m-%d %H:%M')
-                    })
-                elif comment['entity_type'] == 'subtask':
-                    for task_id, task in file_data['tasks'].items():
-                        if comment['entity_id'] in task['subtasks']:
-                            recent_comments.append({
-                                'Project': file_data['problem_name'],
-                                'Task': f"{task['name']} - {task['subtasks'][comment['entity_id']]['name']}",
-                                'User_Name': comment['user_name'],
-                                'Role': comment.get('user_role', 'User'),
-                                'Comment': comment['text'][:100] + '...' if len(comment['text']) > 100 else comment['text'],
-                                'Posted': comment['created_at'].strftime('%Y-%m-%d %H:%M')
-                            })
+        for comment in st.session_state.data.get('comments', {}).values():
+            entity_id = comment['entity_id']
+            if comment['entity_type'] == 'task' and task_parent.get(entity_id) in accessible_files:
+                file_data = accessible_files[task_parent[entity_id]]
+                task_label = file_data['tasks'][entity_id]['name']
+            elif comment['entity_type'] == 'subtask' and entity_id in subtask_parent:
+                file_id, task_id = subtask_parent[entity_id]
+                # Skip comments that don't belong to an accessible file
+                if file_id not in accessible_files:
+                    continue
+                file_data = accessible_files[file_id]
+                task = file_data['tasks'][task_id]
+                task_label = f"{task['name']} - {task['subtasks'][entity_id]['name']}"
+            else:
+                continue
+            recent_comments.append({
+                'Project': file_data['problem_name'],
+                'Task': task_label,
+                'User_Name': comment['user_name'],
+                'Role': comment.get('user_role', 'User'),
+                'Comment': comment['text'][:100] + '...' if len(comment['text']) > 100 else comment['text'],
+                'Posted': comment['created_at']
+            })
         
         if recent_comments:
-            # Sort by date and take last 20
-            recent_comments.sort(key=lambda x: x['Posted'], reverse=True)
-            df_comments = pd.DataFrame(recent_comments[:20])
+            # Take the 20 newest by real timestamp, then format only those
+            recent_comments = heapq.nlargest(20, recent_comments, key=itemgetter('Posted'))
+            for row in recent_comments:
+                row['Posted'] = row['Posted'].strftime('%Y-%m-%d %H:%M')
+            df_comments = pd.DataFrame(recent_comments)
             st.dataframe(df_comments, use_container_width=True, height=400)
         else:
             st.info("No comments yet. Start a conversation on any task or subtask!")
@@ -153,13 +169,15 @@ def show_recent_activity(accessible_files):
                     'Title': contact.get('title', ''),
                     'Email': contact.get('email', ''),
                     'Added By': contact.get('added_by', ''),
-                    'Added On': contact['created_at'].strftime('%Y-%m-%d')
+                    'Added On': contact['created_at']
                 })
         
         if recent_contacts:
-            # Sort by date and take last 20
-            recent_contacts.sort(key=lambda x: x['Added On'], reverse=True)
-            df_contacts = pd.DataFrame(recent_contacts[:20])
+            # Take the 20 newest by real timestamp, then format only those
+            recent_contacts = heapq.nlargest(20, recent_contacts, key=itemgetter('Added On'))
+            for row in recent_contacts:
+                row['Added On'] = row['Added On'].strftime('%Y-%m-%d')
+            df_contacts = pd.DataFrame(recent_contacts)
             st.dataframe(df_contacts, use_container_width=True, height=400)
         else:
             st.info("No contacts added yet.")
\ No newline at end of file
@@ -3,12 +3,43 @@ Data management page module
 """
 import streamlit as st
 import pandas as pd
-import json
+import gzip
+import orjson
 from datetime import datetime
-from database import init_supabase, load_data
-from utils import can_access_data_management, calculate_project_progress
+from database import load_data, clear_data_cache, fetch_table_counts
+from utils import (can_access_data_management, calculate_project_progress, count_file_comments,
+                   count_file_contacts)
 from auth import get_user_role
 
+ROLE_BADGES = {
+    'Admin': '👑',
+    'Partner': '🤝',
+    'User': '👤'
+}
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _build_user_df(users: tuple) -> pd.DataFrame:
+    """User/role table for the user management section; roles come from the cached get_user_role"""
+    roles = [get_user_role(user) for user in users]
+    return pd.DataFrame({
+        'User': users,
+        'Role': [f"{ROLE_BADGES.get(role, '👤')} {role}" for role in roles],
+        'Type': roles
+    })
+
+def export_data_json(data) -> bytes:
+    """
+    Serialize the session data for download
+    
+    orjson writes datetimes natively instead of calling str() per value; the
+    subtasks_df frame and _index lookups are derived from problem_files and left out.
+    """
+    return orjson.dumps(
+        {key: value for key, value in data.items() if key not in ('subtasks_df', '_index')},
+        option=orjson.OPT_INDENT_2 | orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS,
+        default=str
+    )
+
 def show_data_management():
     """Display data management page"""
     if not can_access_data_management():
@@ -23,12 +54,13 @@ def show_data_management():
         st.subheader("Export Data")
         
         if st.button("📥 Download All Data (JSON)"):
-            data_json = json.dumps(st.session_state.data, indent=2, default=str)
+            # Level 1 keeps most of the size reduction at a fraction of the CPU
+            data_json = gzip.compress(export_data_json(st.session_state.data), compresslevel=1)
             st.download_button(
-                label="Download JSON",
+                label="Download JSON (gzip)",
                 data=data_json,
-                file_name=f"problem_tracker_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
-                mime="application/json"
+                file_name=f"problem_tracker_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json.gz",
+                mime="application/gzip"
             )
         
         if st.button("📊 Export Summary to CSV"):
@@ -38,16 +70,8 @@ def show_data_management():
                     progress = calculate_project_progress(file_data['tasks'])
                     
                     # Count comments and contacts
-                    file_comments = 0
-                    for task_id in file_data['tasks']:
-                        file_comments += len([c for c in st.session_state.data.get('comments', {}).values() 
-                                            if c['entity_type'] == 'task' and c['entity_id'] == task_id])
-                        for subtask_id in file_data['tasks'][task_id]['subtasks']:
-                            file_comments += len([c for c in st.session_state.data.get('comments', {}).values() 
-                                                if c['entity_type'] == 'subtask' and c['entity_id'] == subtask_id])
-                    
-                    file_contacts = len([c for c in st.session_state.data.get('contacts', {}).values() 
-                                       if c['problem_file_id'] == file_id])
+                    file_comments = count_file_comments(file_data)
+                    file_contacts = count_file_contacts(file_id)
                     
                     summary_data.append({
                         'Problem File': file_data['problem_name'],
@@ -60,36 +84,29 @@ def show_data_management():
                     })
                 
                 df = pd.DataFrame(summary_data)
-                csv = df.to_csv(index=False)
+                csv = gzip.compress(df.to_csv(index=False).encode('utf-8'), compresslevel=1)
                 st.download_button(
-                    label="Download CSV",
+                    label="Download CSV (gzip)",
                     data=csv,
-                    file_name=f"problem_tracker_summary_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                    mime="text/csv"
+                    file_name=f"problem_tracker_summary_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv.gz",
+                    mime="application/gzip"
                 )
     
     with col2:
         st.subheader("Database Status")
         
         try:
-            supabase = init_supabase()
-            # Test connection
-            test_response = supabase.table('problem_files').select('*').limit(1).execute()
+            # One RPC both tests the connection and returns every table count
+            counts = fetch_table_counts()
             st.success("✅ Connected to Supabase database")
             
             # Show database stats
-            files_count = supabase.table('problem_files').select('*', count='exact').execute()
-            tasks_count = supabase.table('tasks').select('*', count='exact').execute()
-            subtasks_count = supabase.table('subtasks').select('*', count='exact').execute()
-            comments_count = supabase.table('comments').select('*', count='exact').execute()
-            contacts_count = supabase.table('contacts').select('*', count='exact').execute()
-            
             st.info(f"""📊 Database Stats:
-- Problem Files: {files_count.count}
-- Tasks: {tasks_count.count}
-- Subtasks: {subtasks_count.count}
-- Comments: {comments_count.count}
-- Contacts: {contacts_count.count}""")
+- Problem Files: {counts['files']}
+- Tasks: {counts['tasks']}
+- Subtasks: {counts['subtasks']}
+- Comments: {counts['comments']}
+- Contacts: {counts['contacts']}""")
             
         except Exception as e:
             st.error(f"❌ Database connection error: {e}")
@@ -98,22 +115,7 @@ def show_data_management():
     
     # Current users with roles
     st.write("**Current Users:**")
-    user_data = []
-    for user in st.session_state.data['users']:
-        role = get_user_role(user)
-        role_badge = {
-            'Admin': '👑',
-            'Partner': '🤝',
-            'User': '👤'
-        }.get(role, '👤')
-        
-        user_data.append({
-            'User': user,
-            'Role': f"{role_badge} {role}",
-            'Type': role
-        })
-    
-    df_users = pd.DataFrame(user_data)
+    df_users = _build_user_df(tuple(st.session_state.data['users']))
     st.dataframe(df_users, use_container_width=True)
     
     st.info("""💡 **User Management Notes**: 
@@ -125,6 +127,7 @@ def show_data_management():
     # Refresh data button
     st.subheader("🔄 Data Refresh")
     if st.button("🔄 Refresh Data from Database"):
+        clear_data_cache()
         load_data()
         st.success("✅ Data refreshed from Supabase!")
         st.rerun()
\ No newline at end of file
@@ -2,10 +2,15 @@
 Executive summary page module
 """
 import streamlit as st
+import numpy as np
 import pandas as pd
-import plotly.express as px
+import plotly.graph_objects as go
 from datetime import datetime
-from utils import get_accessible_files, calculate_project_progress
+from utils import (get_accessible_files, calculate_project_progress, is_privileged,
+                   count_file_comments, count_file_contacts)
+
+SUMMARY_COLUMNS = ['Problem File', 'Owner', 'Progress', 'Overdue Tasks', 'Comments', 'Contacts',
+                   'Status', 'Last Modified']
 
 def show_executive_summary():
     """Display executive summary page"""
@@ -25,17 +30,34 @@ def show_executive_summary():
     total_contacts = 0
     
     summary_data = []
+    # Overdue subtasks the user may see, collected in the same walk as the per-file counts
+    overdue_details = []
+    today = datetime.now().date()
+    current_user = st.session_state.current_user
+    privileged = is_privileged()
     
     for file_id, file_data in accessible_files.items():
         progress = calculate_project_progress(file_data['tasks'])
         
         # Count overdue tasks
-        overdue_tasks = []
+        overdue_tasks = 0
         for task_id, task in file_data['tasks'].items():
             for subtask_id, subtask in task['subtasks'].items():
-                if (subtask['projected_end_date'].date() < datetime.now().date() and 
-                    subtask['progress'] < 100):
-                    overdue_tasks.append(f"{task['name']} - {subtask['name']}")
+                due_date = subtask['projected_end_date'].date()
+                if due_date < today and subtask['progress'] < 100:
+                    overdue_tasks += 1
+                    # Only show if user has access to this task
+                    if (privileged or 
+                        file_data['owner'] == current_user or 
+                        subtask['assigned_to'] == current_user):
+                        overdue_details.append({
+                            'Project': file_data['problem_name'],
+                            'Task': f"{task['name']} - {subtask['name']}",
+                            'Assigned To': subtask['assigned_to'],
+                            'Days Overdue': (today - due_date).days,
+                            'Progress': f"{subtask['progress']}%",
+                            'Original Due Date': subtask['projected_end_date'].strftime('%Y-%m-%d')
+                        })
         
         if overdue_tasks:
             overdue_count += 1
@@ -44,16 +66,8 @@ def show_executive_summary():
             completed_count += 1
         
         # Count comments and contacts
-        file_comments = 0
-        for task_id in file_data['tasks']:
-            file_comments += len([c for c in st.session_state.data.get('comments', {}).values() 
-                                if c['entity_type'] == 'task' and c['entity_id'] == task_id])
-            for subtask_id in file_data['tasks'][task_id]['subtasks']:
-                file_comments += len([c for c in st.session_state.data.get('comments', {}).values() 
-                                    if c['entity_type'] == 'subtask' and c['entity_id'] == subtask_id])
-        
-        file_contacts = len([c for c in st.session_state.data.get('contacts', {}).values() 
-                           if c['problem_file_id'] == file_id])
+        file_comments = count_file_comments(file_data)
+        file_contacts = count_file_contacts(file_id)
         
         total_comments += file_comments
         total_contacts += file_contacts
@@ -61,12 +75,12 @@ def show_executive_summary():
         summary_data.append({
             'Problem File': file_data['problem_name'],
             'Owner': file_data['owner'],
-            'Progress': f"{progress:.1f}%",
-            'Overdue Tasks': len(overdue_tasks),
+            'Progress': progress,
+            'Overdue Tasks': overdue_tasks,
             'Comments': file_comments,
             'Contacts': file_contacts,
             'Status': '✅ Complete' if progress >= 100 else '🔴 Overdue' if overdue_tasks else '🟡 In Progress',
-            'Last Modified': file_data.get('last_modified', datetime.now()).strftime('%Y-%m-%d %H:%M') if hasattr(file_data.get('last_modified', datetime.now()), 'strftime') else str(file_data.get('last_modified', 'N/A'))
+            'Last Modified': file_data.get('last_modified')
         })
     
     # Key metrics
@@ -86,43 +100,37 @@ def show_executive_summary():
     
     # Summary table
     st.subheader("Project Overview")
-    df_summary = pd.DataFrame(summary_data)
+    df_summary = pd.DataFrame.from_records(summary_data, columns=SUMMARY_COLUMNS)
+    # Raw progress is kept for the histogram; display columns are formatted column-wise
+    progress_values = df_summary['Progress'].to_numpy()
+    df_summary['Progress'] = df_summary['Progress'].map('{:.1f}%'.format)
+    df_summary['Last Modified'] = pd.to_datetime(
+        df_summary['Last Modified'], utc=True, errors='coerce').dt.strftime('%Y-%m-%d %H:%M').fillna('N/A')
     st.dataframe(df_summary, use_container_width=True)
     
     # Progress chart
     st.subheader("Progress Distribution")
-    progress_values = [float(row['Progress'].replace('%', '')) for row in summary_data]
-    
-    fig = px.histogram(
-        x=progress_values,
-        nbins=10,
+    # Bin server-side so the chart carries ten bars rather than every project's value
+    counts, edges = np.histogram(progress_values, bins=10, range=(0, 100))
+    fig = go.Figure(go.Bar(x=(edges[:-1] + edges[1:]) / 2, y=counts, width=edges[1] - edges[0]))
+    fig.update_layout(
         title="Project Progress Distribution",
-        labels={'x': 'Progress (%)', 'y': 'Number of Projects'}
+        xaxis_title='Progress (%)',
+        yaxis_title='Number of Projects'
     )
     st.plotly_chart(fig, use_container_width=True)
     
     # Detailed overdue tasks
-    st.subheader("🚨 Overdue Tasks Details")
-    overdue_details = []
+    _render_overdue(overdue_details)
     
-    for file_id, file_data in accessible_files.items():
-        for task_id, task in file_data['tasks'].items():
-            for subtask_id, subtask in task['subtasks'].items():
-                if (subtask['projected_end_date'].date() < datetime.now().date() and 
-                    subtask['progress'] < 100):
-                    # Only show if user has access to this task
-                    if (st.session_state.user_role in ['Admin', 'Partner'] or 
-                        file_data['owner'] == st.session_state.current_user or 
-                        subtask['assigned_to'] == st.session_state.current_user):
-                        days_overdue = (datetime.now().date() - subtask['projected_end_date'].date()).days
-                        overdue_details.append({
-                            'Project': file_data['problem_name'],
-                            'Task': f"{task['name']} - {subtask['name']}",
-                            'Assigned To': subtask['assigned_to'],
-                            'Days Overdue': days_overdue,
-                            'Progress': f"{subtask['progress']}%",
-                            'Original Due Date': subtask['projected_end_date'].strftime('%Y-%m-%d')
-                        })
+    # Partner Activity Summary (if user is admin or partner)
+    if privileged:
+        _render_partner_activity(accessible_files)
+
+@st.fragment
+def _render_overdue(overdue_details):
+    """Render the overdue subtasks table; interactions rerun only this section"""
+    st.subheader("🚨 Overdue Tasks Details")
     
     if overdue_details:
         df_overdue = pd.DataFrame(overdue_details)
@@ -130,38 +138,44 @@ def show_executive_summary():
         st.dataframe(df_overdue, use_container_width=True)
     else:
         st.success("🎉 No overdue tasks!")
+
+@st.fragment
+def _render_partner_activity(accessible_files):
+    """Render partner comment activity across the accessible files"""
+    st.subheader("🤝 Partner Activity Summary")
     
-    # Partner Activity Summary (if user is admin or partner)
-    if st.session_state.user_role in ['Admin', 'Partner']:
-        st.subheader("🤝 Partner Activity Summary")
-        
-        partner_activity = {}
-        for comment in st.session_state.data.get('comments', {}).values():
-            if comment.get('user_role') == 'Partner':
-                user = comment['user_name']
-                if user not in partner_activity:
-                    partner_activity[user] = {'comments': 0, 'files_engaged': set()}
-                partner_activity[user]['comments'] += 1
-                
-                # Find which file this comment belongs to
-                for file_id, file_data in accessible_files.items():
-                    if comment['entity_type'] == 'task' and comment['entity_id'] in file_data['tasks']:
-                        partner_activity[user]['files_engaged'].add(file_id)
-                    elif comment['entity_type'] == 'subtask':
-                        for task in file_data['tasks'].values():
-                            if comment['entity_id'] in task['subtasks']:
-                                partner_activity[user]['files_engaged'].add(file_id)
-        
-        if partner_activity:
-            partner_data = []
-            for partner, data in partner_activity.items():
-                partner_data.append({
-                    'Partner': partner,
-                    'Total Comments': data['comments'],
-                    'Files Engaged': len(data['files_engaged'])
-                })
+    tree_index = st.session_state.data['_index']
+    task_parent = tree_index['task_parent']
+    subtask_parent = tree_index['subtask_parent']
+    
+    partner_activity = {}
+    for comment in st.session_state.data.get('comments', {}).values():
+        if comment.get('user_role') == 'Partner':
+            user = comment['user_name']
+            if user not in partner_activity:
+                partner_activity[user] = {'comments': 0, 'files_engaged': set()}
+            partner_activity[user]['comments'] += 1
             
-            df_partners = pd.DataFrame(partner_data)
-            st.dataframe(df_partners, use_container_width=True)
-        else:
-            st.info("No partner activity recorded yet.")
\ No newline at end of file
+            # Find which file this comment belongs to
+            if comment['entity_type'] == 'task':
+                file_id = task_parent.get(comment['entity_id'])
+            elif comment['entity_type'] == 'subtask':
+                file_id = subtask_parent.get(comment['entity_id'], (None, None))[0]
+            else:
+                file_id = None
+            if file_id in accessible_files:
+                partner_activity[user]['files_engaged'].add(file_id)
+    
+    if partner_activity:
+        partner_data = []
+        for partner, data in partner_activity.items():
+            partner_data.append({
+                'Partner': partner,
+                'Total Comments': data['comments'],
+                'Files Engaged': len(data['files_engaged'])
+            })
+        
+        df_partners = pd.DataFrame(partner_data)
+        st.dataframe(df_partners, use_container_width=True)
+    else:
+        st.info("No partner activity recorded yet.")
@@ -6,14 +6,17 @@ import pandas as pd
 import uuid
 from datetime import datetime, timedelta
 from database import (save_problem_file, save_task, save_subtask, delete_problem_file, 
-                     delete_task, delete_subtask)
+                     delete_task, delete_subtask, load_data)
 from utils import (get_accessible_files, calculate_project_progress, can_edit_file, 
-                  can_delete_items, check_overdue_and_update)
+                  can_delete_items, check_overdue_and_update, to_midnight, is_privileged,
+                  count_file_comments, count_file_contacts)
 from components.tasks import show_task_management
 from components.visualization import show_gantt_chart_tab, show_file_analytics
 from components.contacts import show_contacts_section
 from components.settings import show_file_settings
 
+FILES_TABLE_COLUMNS = ['ID', 'Name', 'Owner', 'Progress', 'Comments', 'Contacts', 'Created', 'Last Modified']
+
 def show_create_problem_file():
     """Display create problem file page"""
     st.title("➕ Create New Problem File")
@@ -23,7 +26,7 @@ def show_create_problem_file():
         with col1:
             problem_name = st.text_input("Problem Name*")
             # Admin and Partners can assign to any user, others default to themselves
-            if st.session_state.user_role in ['Admin', 'Partner']:
+            if is_privileged():
                 owner = st.selectbox("Owner*", st.session_state.data['users'])
             else:
                 owner = st.session_state.current_user
@@ -50,8 +53,8 @@ def show_create_problem_file():
                     file_data = {
                         'problem_name': problem_name,
                         'owner': owner,
-                        'project_start_date': datetime.combine(project_start_date, datetime.min.time()),
-                        'project_end_date': datetime.combine(project_end_date, datetime.min.time()),
+                        'project_start_date': to_midnight(project_start_date),
+                        'project_end_date': to_midnight(project_end_date),
                         'display_week': display_week,
                         'tasks': {},
                         'created_date': datetime.now(),
@@ -96,57 +99,52 @@ def show_my_problem_files():
     with col1:
         st.metric("Total Files", len(accessible_files))
     with col2:
-        owned_files = len([f for f in accessible_files.values() if f['owner'] == st.session_state.current_user])
+        owned_files = sum(1 for f in accessible_files.values() if f['owner'] == st.session_state.current_user)
         st.metric("Files I Own", owned_files)
     with col3:
         assigned_files = len(accessible_files) - owned_files
         st.metric("Files Assigned To Me", assigned_files)
     with col4:
-        completed = len([f for f in accessible_files.values() if calculate_project_progress(f['tasks']) >= 100])
+        completed = sum(1 for f in accessible_files.values() if calculate_project_progress(f['tasks']) >= 100)
         st.metric("Completed", completed)
     
     # Files table with actions
     st.subheader("Problem Files")
     
     files_data = []
+    now = datetime.now()
     for file_id, file_data in accessible_files.items():
         progress = calculate_project_progress(file_data['tasks'])
         
         # Count comments and contacts
-        comments_count = 0
-        for task in file_data['tasks'].values():
-            comments_count += len([c for c in st.session_state.data.get('comments', {}).values() 
-                                 if c['entity_type'] == 'task' and c['entity_id'] in file_data['tasks']])
-            for subtask_id in task['subtasks']:
-                comments_count += len([c for c in st.session_state.data.get('comments', {}).values() 
-                                     if c['entity_type'] == 'subtask' and c['entity_id'] == subtask_id])
-        
-        contacts_count = len([c for c in st.session_state.data.get('contacts', {}).values() 
-                            if c['problem_file_id'] == file_id])
+        comments_count = count_file_comments(file_data)
+        contacts_count = count_file_contacts(file_id)
         
         files_data.append({
             'ID': file_id,
             'Name': file_data['problem_name'],
             'Owner': file_data['owner'],
-            'Progress': f"{progress:.1f}%",
+            'Progress': progress,
             'Comments': comments_count,
             'Contacts': contacts_count,
-            'Created': file_data.get('created_date', datetime.now()).strftime('%Y-%m-%d'),
-            'Last Modified': file_data.get('last_modified', datetime.now()).strftime('%Y-%m-%d %H:%M')
+            'Created': file_data.get('created_date', now),
+            'Last Modified': file_data.get('last_modified', now)
         })
     
     if files_data:
-        df_files = pd.DataFrame(files_data)
+        df_files = pd.DataFrame.from_records(files_data, columns=FILES_TABLE_COLUMNS)
+        # Format display columns column-wise rather than per row
+        df_files['Progress'] = df_files['Progress'].map('{:.1f}%'.format)
+        df_files['Created'] = pd.to_datetime(df_files['Created'], utc=True).dt.strftime('%Y-%m-%d')
+        df_files['Last Modified'] = pd.to_datetime(df_files['Last Modified'], utc=True).dt.strftime('%Y-%m-%d %H:%M')
         st.dataframe(df_files.drop('ID', axis=1), use_container_width=True)
 
         # Manual selection dropdown
-        file_selector = {
-            f"{file['Name']} (Owner: {file['Owner']})": file["ID"]
-            for file in files_data
-        }
-
-        selected_label = st.selectbox("Select a file to manage:", list(file_selector.keys()))
-        selected_file_id = file_selector[selected_label]
+        # Select over file ids directly; labels are formatted only for display
+        selected_file_id = st.selectbox(
+            "Select a file to manage:", list(accessible_files),
+            format_func=lambda fid: f"{accessible_files[fid]['problem_name']} (Owner: {accessible_files[fid]['owner']})"
+        )
         selected_file_data = accessible_files[selected_file_id]
 
         # Action buttons
@@ -229,9 +227,7 @@ def show_individual_problem_file(file_id):
         total_subtasks = sum(len(task['subtasks']) for task in problem_file['tasks'].values())
         st.metric("Total Subtasks", total_subtasks)
     with col5:
-        contacts_count = len([c for c in st.session_state.data.get('contacts', {}).values() 
-                            if c['problem_file_id'] == file_id])
-        st.metric("Contacts", contacts_count)
+        st.metric("Contacts", count_file_contacts(file_id))
     
     # Check permissions
     can_edit = can_edit_file(problem_file['owner'])
@@ -242,6 +238,9 @@ def show_individual_problem_file(file_id):
     # Check for overdue tasks and update (only if can edit)
     if can_edit and check_overdue_and_update(problem_file):
         st.warning("Some overdue tasks have been automatically updated with new deadlines.")
+        # Refetch so the subtask frame used by the charts has the new deadlines
+        load_data()
+        problem_file = st.session_state.data['problem_files'][file_id]
     
     # Navigation tabs
     tabs = st.tabs(["📋 Tasks & Subtasks", "📊 Gantt Chart", "📇 Contacts", "📝 File Settings", "📈 Analytics"])
@@ -250,7 +249,7 @@ def show_individual_problem_file(file_id):
         show_task_management(file_id, problem_file, can_edit)
     
     with tabs[1]:
-        show_gantt_chart_tab(problem_file)
+        show_gantt_chart_tab(problem_file, file_id)
     
     with tabs[2]:
         show_contacts_section(file_id, problem_file)
@@ -259,4 +258,4 @@ def show_individual_problem_file(file_id):
         show_file_settings(file_id, problem_file, can_edit)
     
     with tabs[4]:
-        show_file_analytics(problem_file)
\ No newline at end of file
+        show_file_analytics(problem_file, file_id)
\ No newline at end of file
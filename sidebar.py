@@ -5,21 +5,8 @@ import streamlit as st
 from auth import logout
 from utils import can_access_data_management
 
-def show_sidebar():
-    """Display sidebar with navigation"""
-    with st.sidebar:
-        # Home button
-        st.markdown("<div id='home-btn-wrapper'>", unsafe_allow_html=True)
-        st.markdown('<span id="button-after"></span>', unsafe_allow_html=True)
-        if st.button("**🔧 Problem File Dashboard**", key="home", use_container_width=True):
-            st.session_state.page = "Dashboard"
-            st.session_state.current_file_id = None
-            st.session_state.selected_file_for_view = None
-            st.rerun()
-        st.markdown("</div>", unsafe_allow_html=True)
-
-        # CSS for home button
-        st.markdown("""
+# Styles the home button as a plain title link
+_HOME_BTN_CSS = """
             <style>
                 .element-container:has(#button-after) + div button {
                 background-color: transparent !important;
@@ -35,7 +22,23 @@ def show_sidebar():
                 color: #2f74c0 !important;
                 background-color: transparent !important;
             }
-        </style>""", unsafe_allow_html=True)
+        </style>"""
+
+def show_sidebar():
+    """Display sidebar with navigation"""
+    with st.sidebar:
+        # Home button
+        st.markdown("<div id='home-btn-wrapper'>", unsafe_allow_html=True)
+        st.markdown('<span id="button-after"></span>', unsafe_allow_html=True)
+        if st.button("**🔧 Problem File Dashboard**", key="home", use_container_width=True):
+            st.session_state.page = "Dashboard"
+            st.session_state.current_file_id = None
+            st.session_state.selected_file_for_view = None
+            st.rerun()
+        st.markdown("</div>", unsafe_allow_html=True)
+
+        # CSS for home button; re-sent every run, since Streamlit drops elements a run doesn't emit
+        st.markdown(_HOME_BTN_CSS, unsafe_allow_html=True)
 
         # User info with role badge
         role_badge = {
@@ -64,8 +67,9 @@ def show_sidebar():
             if file_data:
                 nav_options.append(f"📁 {file_data['problem_name']}")
         
-        page = st.selectbox("Navigate to:", nav_options, 
-                           index=nav_options.index(st.session_state.page) if st.session_state.page in nav_options else 0)
+        nav_index = {name: i for i, name in enumerate(nav_options)}
+        page = st.selectbox("Navigate to:", nav_options,
+                           index=nav_index.get(st.session_state.page, 0))
         
         # Update session state when page changes
         if page != st.session_state.page:
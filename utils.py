@@ -2,20 +2,27 @@
 Utility functions for permissions and calculations
 """
 import streamlit as st
+import numpy as np
 from datetime import datetime, timedelta
 
+PRIVILEGED_ROLES = frozenset({'Admin', 'Partner'})
+
 # Permission checking functions
+def is_privileged():
+    """Check if current user has an Admin or Partner role"""
+    return st.session_state.user_role in PRIVILEGED_ROLES
+
 def can_access_data_management():
     """Check if user can access data management"""
     return st.session_state.user_role == 'Admin'
 
 def can_delete_items():
     """Check if user can delete items"""
-    return st.session_state.user_role in ['Admin', 'Partner']
+    return is_privileged()
 
 def can_edit_all_files():
     """Check if user can edit all problem files"""
-    return st.session_state.user_role in ['Admin', 'Partner']
+    return is_privileged()
 
 def can_create_files():
     """Check if user can create problem files"""
@@ -23,11 +30,16 @@ def can_create_files():
 
 def can_edit_file(file_owner):
     """Check if user can edit a specific file"""
-    return st.session_state.user_role in ['Admin', 'Partner'] or st.session_state.current_user == file_owner
+    return is_privileged() or st.session_state.current_user == file_owner
 
 def can_manage_contacts(file_owner):
     """Check if user can manage contacts for a file"""
-    return st.session_state.user_role in ['Admin', 'Partner'] or st.session_state.current_user == file_owner
+    return is_privileged() or st.session_state.current_user == file_owner
+
+# Date helpers
+def to_midnight(d):
+    """Turn a date from st.date_input into a midnight datetime without going through combine()"""
+    return datetime(d.year, d.month, d.day)
 
 # Calculation functions
 def calculate_task_progress(subtasks):
@@ -38,24 +50,44 @@ def calculate_task_progress(subtasks):
     return total_progress / len(subtasks)
 
 def calculate_project_progress(tasks):
-    """Calculate overall project progress"""
+    """Calculate overall project progress: the mean of task progress, tasks without subtasks counting 0"""
     if not tasks:
         return 0
-    task_progresses = []
-    for task in tasks.values():
-        if task['subtasks']:
-            task_progress = calculate_task_progress(task['subtasks'])
-        else:
-            task_progress = 0
-        task_progresses.append(task_progress)
-    return sum(task_progresses) / len(task_progresses) if task_progresses else 0
+    counts = np.fromiter((len(task['subtasks']) for task in tasks.values()), dtype=np.intp, count=len(tasks))
+    total = int(counts.sum())
+    if not total:
+        return 0
+    
+    # Every subtask's progress in one array, then one segmented sum per non-empty task
+    progresses = np.fromiter(
+        (subtask['progress'] for task in tasks.values() for subtask in task['subtasks'].values()),
+        dtype=np.float64, count=total
+    )
+    has_subtasks = counts > 0
+    offsets = (np.cumsum(counts) - counts)[has_subtasks]
+    task_means = np.add.reduceat(progresses, offsets) / counts[has_subtasks]
+    return float(task_means.sum() / len(tasks))
+
+def count_file_comments(file_data):
+    """Count task and subtask comments in a file from the per-entity comment counts"""
+    comment_counts = st.session_state.comment_counts
+    return sum(
+        comment_counts.get(('task', task_id), 0)
+        + sum(comment_counts.get(('subtask', subtask_id), 0) for subtask_id in task.get('subtasks', {}))
+        for task_id, task in file_data.get('tasks', {}).items()
+    )
+
+def count_file_contacts(file_id):
+    """Count a file's contacts from the per-file contact index"""
+    return len(st.session_state.contacts_by_file.get(file_id, {}))
 
 def check_overdue_and_update(problem_file):
     """Check for overdue tasks and update them"""
-    from database import save_subtask
+    from database import save_subtasks_bulk
     
     today = datetime.now().date()
-    updated = False
+    note = f"\n[AUTO-UPDATE {today.strftime('%Y-%m-%d')}]: Deadline pushed forward due to overdue status."
+    pending = []
     
     for task_id, task in problem_file['tasks'].items():
         for subtask_id, subtask in task['subtasks'].items():
@@ -63,32 +95,20 @@ def check_overdue_and_update(problem_file):
                 subtask['progress'] < 100):
                 # Push forward by 1 week
                 subtask['projected_end_date'] += timedelta(weeks=1)
-                subtask['notes'] += f"\n[AUTO-UPDATE {datetime.now().strftime('%Y-%m-%d')}]: Deadline pushed forward due to overdue status."
-                
-                # Save the updated subtask to database
-                save_subtask(task_id, subtask_id, subtask)
-                updated = True
+                subtask['notes'] += note
+                pending.append((task_id, subtask_id, subtask))
+    
+    # Save every pushed subtask in one request
+    if pending:
+        save_subtasks_bulk(pending)
     
-    return updated
+    return bool(pending)
 
 def get_accessible_files():
     """Get files accessible to current user"""
     if not st.session_state.authenticated:
         return {}
     
-    if st.session_state.user_role in ['Admin', 'Partner']:
-        return st.session_state.data['problem_files']
-    else:
-        # Regular users can only see files they own or are assigned to
-        accessible_files = {}
-        for file_id, file_data in st.session_state.data['problem_files'].items():
-            if file_data['owner'] == st.session_state.current_user:
-                accessible_files[file_id] = file_data
-            else:
-                # Check if user is assigned to any tasks in this file
-                for task_id, task in file_data['tasks'].items():
-                    for subtask_id, subtask in task['subtasks'].items():
-                        if subtask['assigned_to'] == st.session_state.current_user:
-                            accessible_files[file_id] = file_data
-                            break
-        return accessible_files
\ No newline at end of file
+    # load_data already fetches only the files this user may see: everything for
+    # Admin/Partner, owned or assigned files for regular users
+    return st.session_state.data['problem_files']
\ No newline at end of file